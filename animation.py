@@ -0,0 +1,47 @@
+# Animation clips
+#
+# Every (sprite, state, facing) combination has a small integer id and
+# entities keep only that id and a phase offset. The frame tables are looked
+# up from the image registry once and shared by every entity; the frame to
+# show is worked out from the game clock when a sprite is drawn, so sprites
+# nobody sees cost nothing and no entity swaps image lists.
+#
+# Ids come in right/left pairs: id + LEFT is the left-facing clip. The hero
+# has one pair per motion, at HERO + 2 * motion.
+CLIPS = [('hero_idle_rt', 10), ('hero_idle_lt', 10),
+         ('hero_walk_rt', 10), ('hero_walk_lt', 10),
+         ('hero_jump_rt', 10), ('hero_jump_lt', 10),
+         ('slime_rt', 10), ('slime_lt', 10),
+         ('wingman_rt', 8), ('wingman_lt', 8)]
+
+RIGHT = 0
+LEFT = 1
+
+HERO = 0
+SLIME = 6
+WINGMAN = 8
+
+IDLE = 0
+WALK = 1
+JUMP = 2
+
+
+class AnimationLibrary:
+
+    def __init__(self, images):
+        self.images = images
+        self.tables = [None] * len(CLIPS)
+        self.speeds = [speed for name, speed in CLIPS]
+
+    def frames(self, clip):
+        table = self.tables[clip]
+
+        if table is None:
+            table = tuple(self.images[CLIPS[clip][0]])
+            self.tables[clip] = table
+
+        return table
+
+    def frame(self, clip, ticks):
+        table = self.tables[clip] or self.frames(clip)
+        return table[ticks // self.speeds[clip] % len(table)]
@@ -0,0 +1,248 @@
+# Imports
+import threading
+import weakref
+import pygame
+from level_data import load_level, GRASS, BLOCK, DIRT
+
+
+# Asset manifest
+#
+# Animations are lists of frames and are looked up as name + '_rt' or
+# name + '_lt'; the left-facing frames are flipped copies of the right ones.
+ANIMATIONS = {'hero_idle': ['assets/images/characters/alien/alienBeige_stand.png'],
+              'hero_walk': ['assets/images/characters/alien/alienBeige_walk1.png',
+                            'assets/images/characters/alien/alienBeige_walk2.png'],
+              'hero_jump': ['assets/images/characters/alien/alienBeige_jump.png'],
+              'slime': ['assets/images/characters/enemies/moreenemies/slime.png',
+                        'assets/images/characters/enemies/moreenemies/slime_walk.png'],
+              'wingman': ['assets/images/characters/enemies/wingMan1.png',
+                          'assets/images/characters/enemies/wingMan2.png',
+                          'assets/images/characters/enemies/wingMan3.png',
+                          'assets/images/characters/enemies/wingMan4.png',
+                          'assets/images/characters/enemies/wingMan5.png']}
+
+IMAGES = {'dirt': 'assets/images/PNG/tiles/dirt.png',
+          'block': 'assets/images/PNG/tiles/stone_block.png',
+          'door_top': 'assets/images/PNG/tiles/door_top.png',
+          'door': 'assets/images/PNG/tiles/door.png',
+          'grass_dirt': 'assets/images/PNG/tiles/grass_dirt.png',
+          'gold': 'assets/images/PNG/items/gold_1.png',
+          'bronze': 'assets/images/PNG/items/bronze_1.png',
+          'heart': 'assets/images/PNG/items/heart.png',
+          'gem': 'assets/images/HUD/coin_gold.png',
+          'background': 'assets/images/background/backgroundColorForest.png'}
+
+SOUNDS = {'jump': 'assets/sounds/jump.wav',
+          'coin': 'assets/sounds/obtained_coin.ogg',
+          'level_complete': 'assets/sounds/level_complete.ogg',
+          'hurt': 'assets/sounds/hurt.ogg',
+          'lose': 'assets/sounds/lose.ogg',
+          'win': 'assets/sounds/win.ogg'}
+
+TILE_IMAGES = {GRASS: 'grass_dirt',
+               BLOCK: 'block',
+               DIRT: 'dirt'}
+
+ENTITY_IMAGES = {'flag': ['door_top', 'door'],
+                 'gold': ['gold'],
+                 'bronze': ['bronze'],
+                 'spikeman': ['slime_rt', 'slime_lt'],
+                 'flyman': ['wingman_rt', 'wingman_lt']}
+
+HERO_IMAGES = ['hero_idle_rt', 'hero_idle_lt', 'hero_walk_rt', 'hero_walk_lt', 'hero_jump_rt', 'hero_jump_lt']
+
+
+def level_assets(path):
+    level = load_level(path)
+
+    names = set(HERO_IMAGES)
+    names.update(TILE_IMAGES[kind] for x, y, kind in level.tile_locs())
+
+    for kind, locs in level.entities.items():
+        if len(locs) > 0:
+            names.update(ENTITY_IMAGES[kind])
+
+    return sorted(names)
+
+
+# Registry
+#
+# Decoded images are kept up to budget bytes, least recently used first out.
+# Everything handed out is also tracked through weak references (frame by
+# frame for animations, since lists can't be referenced weakly), so an image
+# that was evicted while a sprite still shows it is found again instead of
+# being decoded a second time.
+#
+# Background preloads decode without holding the lock and only take it to
+# publish the result, so lookups from the main loop never wait on a PNG.
+class AssetRegistry:
+
+    def __init__(self, budget=32 * 1024 * 1024, convert=None, atlas=False):
+        self.budget = budget
+        self.convert = convert
+        self.use_atlas = atlas
+        self.atlas = None
+
+        self.cache = {}
+        self.refs = {}
+        self.sizes = {}
+        self.used = {}
+        self.clock = 0
+        self.total = 0
+
+        self.sounds = {}
+        self.lock = threading.RLock()
+        self.atlas_lock = threading.Lock()
+
+    def __getitem__(self, name):
+        with self.lock:
+            value = self.find(name)
+
+        if value is None:
+            value = self.load(name)
+
+        with self.lock:
+            self.clock += 1
+            self.used[name] = self.clock
+
+        return value
+
+    def load(self, name):
+        with self.lock:
+            value = self.find(name)
+
+        if value is not None:
+            return value
+
+        value = self.decode(name)
+
+        with self.lock:
+            # another thread may have published it while this one decoded
+            current = self.find(name)
+
+            if current is not None:
+                return current
+
+            if isinstance(value, list):
+                self.refs[name] = [weakref.ref(img) for img in value]
+            else:
+                self.refs[name] = weakref.ref(value)
+
+            self.publish(name, value)
+
+            return value
+
+    def find(self, name):
+        value = self.cache.get(name)
+
+        if value is not None:
+            return value
+
+        refs = self.refs.get(name)
+
+        if refs is None:
+            return None
+        elif isinstance(refs, list):
+            value = [ref() for ref in refs]
+
+            if any(img is None for img in value):
+                value = None
+        else:
+            value = refs()
+
+        if value is None:
+            del self.refs[name]
+        else:
+            self.publish(name, value)
+
+        return value
+
+    def publish(self, name, value):
+        if self.atlas is not None and name in self.atlas.frames:
+            size = 0
+        elif isinstance(value, list):
+            size = sum(img.get_width() * img.get_height() * img.get_bytesize() for img in value)
+        else:
+            size = value.get_width() * value.get_height() * value.get_bytesize()
+
+        self.cache[name] = value
+        self.sizes[name] = size
+        self.used[name] = self.clock
+        self.total += size
+
+        self.evict(name)
+
+    def decode(self, name):
+        if self.use_atlas:
+            with self.atlas_lock:
+                if self.atlas is None:
+                    from atlas import load_atlas
+                    self.atlas = load_atlas(self.should_convert())
+
+            if name in self.atlas.frames:
+                frames = self.atlas.surfaces(name)
+
+                if name[:-3] in ANIMATIONS:
+                    return frames
+                else:
+                    return frames[0]
+
+        if name.endswith('_lt') and name[:-3] in ANIMATIONS:
+            return [pygame.transform.flip(img, True, False) for img in self.load(name[:-3] + '_rt')]
+        elif name.endswith('_rt') and name[:-3] in ANIMATIONS:
+            return [self.load_image(path) for path in ANIMATIONS[name[:-3]]]
+        else:
+            return self.load_image(IMAGES[name])
+
+    def should_convert(self):
+        if self.convert is None:
+            return pygame.display.get_surface() is not None
+
+        return self.convert
+
+    def load_image(self, path):
+        image = pygame.image.load(path)
+
+        if self.should_convert():
+            image = image.convert_alpha()
+
+        return image
+
+    def evict(self, keep):
+        if self.total <= self.budget:
+            return
+
+        names = sorted([n for n in self.cache if n != keep and self.sizes[n] > 0], key=self.used.get)
+
+        for name in names:
+            if self.total <= self.budget:
+                break
+
+            self.total -= self.sizes.pop(name)
+            del self.cache[name]
+            del self.used[name]
+
+    def sound(self, name):
+        sound = self.sounds.get(name)
+
+        if sound is None:
+            sound = pygame.mixer.Sound(SOUNDS[name])
+            self.sounds[name] = sound
+
+        return sound
+
+    def preload(self, names):
+        thread = threading.Thread(target=self.load_all, args=[list(names)], daemon=True)
+        thread.start()
+
+        return thread
+
+    def load_all(self, names):
+        for name in names:
+            self.load(name)
+
+    def preload_level(self, path):
+        thread = threading.Thread(target=lambda: self.load_all(level_assets(path)), daemon=True)
+        thread.start()
+
+        return thread
@@ -0,0 +1,195 @@
+# Imports
+import hashlib
+import json
+import os
+import threading
+import pygame
+from assets import ANIMATIONS, IMAGES
+
+
+# Atlas settings
+#
+# Every manifest image and the flipped copy of every animation frame is
+# packed into RGBA pages. The pages are cached on disk as raw pixel buffers
+# next to a JSON frame table, so a warm start reads them straight back
+# without decoding or flipping any PNGs.
+VERSION = 1
+PAGE_WIDTH = 1024
+CACHE_DIR = os.path.join('assets', '.cache')
+
+
+class Atlas:
+
+    def __init__(self, pages, frames):
+        self.pages = pages
+        self.frames = frames
+
+    def surfaces(self, name):
+        return [self.pages[page].subsurface(rect) for page, rect in self.frames[name]]
+
+    def convert(self):
+        self.pages = [page.convert_alpha() for page in self.pages]
+
+
+# Building
+def source_images():
+    images = {}
+
+    for name, paths in ANIMATIONS.items():
+        frames = [pygame.image.load(path) for path in paths]
+        images[name + '_rt'] = frames
+        images[name + '_lt'] = [pygame.transform.flip(img, True, False) for img in frames]
+
+    for name, path in IMAGES.items():
+        images[name] = [pygame.image.load(path)]
+
+    return images
+
+def pack(sizes, page_width=PAGE_WIDTH):
+    order = sorted(range(len(sizes)), key=lambda i: -sizes[i][1])
+    places = [None] * len(sizes)
+    pages = []
+    x = y = shelf = 0
+
+    for i in order:
+        w, h = sizes[i]
+
+        if w > page_width:
+            pages.append([w, h])
+            places[i] = (len(pages) - 1, 0, 0)
+            continue
+
+        if x + w > page_width:
+            y += shelf
+            x = shelf = 0
+
+        if len(pages) == 0 or pages[-1][0] > page_width or (y > 0 and y + h > page_width):
+            pages.append([page_width, 0])
+            x = y = shelf = 0
+
+        places[i] = (len(pages) - 1, x, y)
+        pages[-1][1] = max(pages[-1][1], y + h)
+        x += w
+        shelf = max(shelf, h)
+
+    return places, [tuple(size) for size in pages]
+
+def build_atlas():
+    images = source_images()
+
+    names = []
+    surfaces = []
+
+    for name, frames in images.items():
+        for img in frames:
+            names.append(name)
+            surfaces.append(img)
+
+    places, page_sizes = pack([img.get_size() for img in surfaces])
+    buffers = [bytearray(w * h * 4) for w, h in page_sizes]
+    frames = {name: [] for name in images}
+
+    for name, img, (page, x, y) in zip(names, surfaces, places):
+        w, h = img.get_size()
+        stride = page_sizes[page][0] * 4
+        raw = pygame.image.tobytes(img, 'RGBA')
+
+        for row in range(h):
+            start = (y + row) * stride + x * 4
+            buffers[page][start:start + w * 4] = raw[row * w * 4:(row + 1) * w * 4]
+
+        frames[name].append((page, (x, y, w, h)))
+
+    return buffers, page_sizes, frames
+
+
+# Disk cache
+def atlas_key():
+    digest = hashlib.sha1(str([VERSION, PAGE_WIDTH]).encode())
+
+    paths = [path for name in sorted(ANIMATIONS) for path in ANIMATIONS[name]]
+    paths += [IMAGES[name] for name in sorted(IMAGES)]
+
+    for path in paths:
+        digest.update(path.encode())
+
+        with open(path, 'rb') as f:
+            digest.update(f.read())
+
+    return digest.hexdigest()
+
+def save_cache(key, buffers, page_sizes, frames, cache_dir=CACHE_DIR):
+    os.makedirs(cache_dir, exist_ok=True)
+    suffix = '.' + str(os.getpid()) + '.' + str(threading.get_ident()) + '.tmp'
+
+    for i, buffer in enumerate(buffers):
+        path = os.path.join(cache_dir, 'atlas-' + key + '-' + str(i) + '.rgba')
+
+        with open(path + suffix, 'wb') as f:
+            f.write(buffer)
+
+        os.replace(path + suffix, path)
+
+    path = os.path.join(cache_dir, 'atlas-' + key + '.json')
+
+    with open(path + suffix, 'w') as f:
+        json.dump({'pages': page_sizes, 'frames': frames}, f)
+
+    os.replace(path + suffix, path)
+
+def load_cache(key, cache_dir=CACHE_DIR):
+    path = os.path.join(cache_dir, 'atlas-' + key + '.json')
+
+    if not os.path.exists(path):
+        return None
+
+    try:
+        with open(path) as f:
+            table = json.load(f)
+
+        buffers = []
+
+        for i, (w, h) in enumerate(table['pages']):
+            with open(os.path.join(cache_dir, 'atlas-' + key + '-' + str(i) + '.rgba'), 'rb') as f:
+                buffer = f.read()
+
+            if len(buffer) != w * h * 4:
+                return None
+
+            buffers.append(buffer)
+    except (OSError, ValueError, KeyError):
+        return None
+
+    frames = {name: [(page, tuple(rect)) for page, rect in entries] for name, entries in table['frames'].items()}
+
+    return buffers, [tuple(size) for size in table['pages']], frames
+
+
+# Loading
+def load_atlas(convert=True, cache_dir=CACHE_DIR):
+    key = atlas_key()
+    cached = load_cache(key, cache_dir)
+
+    if cached is None:
+        cached = build_atlas()
+
+        try:
+            save_cache(key, *cached, cache_dir=cache_dir)
+        except OSError:
+            pass
+
+    buffers, page_sizes, frames = cached
+    pages = [pygame.image.frombuffer(buffer, size, 'RGBA') for buffer, size in zip(buffers, page_sizes)]
+    atlas = Atlas(pages, frames)
+
+    if convert:
+        atlas.convert()
+
+    return atlas
+
+
+if __name__ == '__main__':
+    buffers, page_sizes, frames = build_atlas()
+    save_cache(atlas_key(), buffers, page_sizes, frames)
+
+    print(str(len(frames)) + ' images packed into pages ' + ', '.join(str(w) + 'x' + str(h) for w, h in page_sizes))
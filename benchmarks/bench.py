@@ -0,0 +1,257 @@
+# Imports
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+import pygame
+import level_data
+import simulation
+from simulation import Game, Inputs, GRID_SIZE, WIDTH, HEIGHT, ACTIVE_MARGIN
+from render import BACKENDS, make_backend, StaticLayer, draw_world
+
+
+# Benchmark settings
+#
+# Every case is a synthetic level with roughly the given number of tiles and
+# enemies. The hero walks right and jumps at a fixed rhythm with hearts that
+# never run out, so every case simulates the same kind of play. Drawing
+# goes through the same static layer and sprite culling as the game, with
+# LAYER_CHUNKS baked chunks kept in streaming mode. Memory is only traced
+# with --memory, as tracing slows down the level start it would be measured
+# alongside.
+TILES = [1000, 10000, 100000]
+ENEMIES = [10, 500, 5000]
+TICKS = 300
+ROWS = 12
+LAYER_CHUNKS = 8
+
+
+# Synthetic levels
+def make_level(tiles, enemies, seed=0):
+    rng = random.Random(seed)
+    width = max(tiles // 3, 40)
+
+    grass = [[x, ROWS - 2] for x in range(width)]
+    dirt = [[x, ROWS - 1] for x in range(width)]
+    blocks = set()
+
+    while len(grass) + len(dirt) + len(blocks) < tiles and len(blocks) < width * 4:
+        blocks.add((rng.randrange(4, width), rng.randrange(2, ROWS - 4)))
+
+    slimes = [[rng.randrange(4, width), ROWS - 3] for i in range(enemies - enemies // 2)]
+    flymen = [[rng.randrange(4, width), rng.randrange(1, ROWS - 4)] for i in range(enemies // 2)]
+
+    return {'width': width,
+            'height': ROWS,
+            'start': [1, ROWS - 3],
+            'gravity': 1.0,
+            'terminal_velocity': 20,
+            'grass_locs': grass,
+            'dirt_locs': dirt,
+            'block_locs': [list(loc) for loc in sorted(blocks)],
+            'flag_locs': [[width - 1, ROWS - 3], [width - 1, ROWS - 4]],
+            'gold_locs': [[x, ROWS - 4] for x in range(6, width, 9)],
+            'bronze_locs': [],
+            'spikeman_locs': slimes,
+            'flyman_locs': flymen}
+
+def write_level(data, directory):
+    path = os.path.join(directory, 'bench-' + str(len(data['grass_locs'])) + '-' +
+                        str(len(data['spikeman_locs']) + len(data['flyman_locs'])) + '.json')
+
+    with open(path, 'w') as f:
+        json.dump(data, f)
+
+    return path
+
+
+# Measuring
+def bench_inputs(tick):
+    return Inputs(1, tick % 40 == 0)
+
+def summary(samples):
+    samples = sorted(samples)
+    n = len(samples)
+
+    return {'mean_ms': 1000 * sum(samples) / n,
+            'median_ms': 1000 * samples[n // 2],
+            'p95_ms': 1000 * samples[min(n - 1, n * 95 // 100)],
+            'max_ms': 1000 * samples[-1]}
+
+def measure_load(path, cache_dir):
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    level_data.loaded.clear()
+    start = time.perf_counter()
+    level_data.load_level(path, cache_dir)
+    cold = time.perf_counter() - start
+
+    level_data.loaded.clear()
+    start = time.perf_counter()
+    level = level_data.load_level(path, cache_dir)
+    warm = time.perf_counter() - start
+
+    return level, {'compile_ms': 1000 * cold, 'cached_ms': 1000 * warm}
+
+def new_game(path, images, streaming, batch_enemies, active_region):
+    game = Game(images, [path], 0, batch_enemies, streaming, ACTIVE_MARGIN if active_region else None)
+    game.begin()
+    game.hero.hearts = 10 ** 9
+
+    return game
+
+def static_layer(screen, game):
+    if game.streaming:
+        return StaticLayer(screen, [game.platforms, game.goal], game.world_width, HEIGHT,
+                           game.chunk_cols * GRID_SIZE, LAYER_CHUNKS)
+    else:
+        return StaticLayer(screen, [game.platforms, game.goal], game.world_width, HEIGHT, WIDTH)
+
+def draw(screen, game, layer, background):
+    draw_world(screen, game, layer, background, game.camera_offset(), 1.0, GRID_SIZE)
+    screen.present()
+
+def run_case(path, tiles, enemies, ticks, images, screen, cache_dir, streaming=False, batch_enemies=False,
+             active_region=False, memory=False):
+    level, load = measure_load(path, cache_dir)
+
+    if memory:
+        tracemalloc.start()
+
+    start = time.perf_counter()
+    game = new_game(path, images, streaming, batch_enemies, active_region)
+    load['start_level_ms'] = 1000 * (time.perf_counter() - start)
+
+    if memory:
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    start = time.perf_counter()
+    layer = static_layer(screen, game)
+    load['static_layer_ms'] = 1000 * (time.perf_counter() - start)
+
+    background = images['background']
+    update = []
+    drawing = []
+
+    for tick in range(ticks):
+        start = time.perf_counter()
+        game.step(bench_inputs(tick))
+        update.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        draw(screen, game, layer, background)
+        drawing.append(time.perf_counter() - start)
+
+    screen.release_all()
+
+    return {'tiles': tiles,
+            'enemies': enemies,
+            'level_tiles': sum(1 for loc in level.tile_locs()),
+            'level_cols': level.cols,
+            'streaming': streaming,
+            'batch_enemies': batch_enemies,
+            'active_region': active_region,
+            'ticks': ticks,
+            'hero_x': game.hero.rect.x,
+            'load': load,
+            'update': summary(update),
+            'draw': summary(drawing),
+            'memory': {'game_mb': current / 1e6, 'peak_mb': peak / 1e6} if memory else None}
+
+def revision():
+    try:
+        out = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True, text=True)
+    except OSError:
+        return None
+
+    return out.stdout.strip() or None
+
+def report(result):
+    text = ('%7d tiles %5d enemies%s%s%s  load %8.1f ms  start %8.1f ms  update %7.3f ms (p95 %7.3f)  '
+            'draw %6.3f ms' % (result['tiles'], result['enemies'],
+                               ' stream' if result['streaming'] else '',
+                               ' batch' if result['batch_enemies'] else '',
+                               ' region' if result['active_region'] else '',
+                               result['load']['compile_ms'], result['load']['start_level_ms'],
+                               result['update']['mean_ms'], result['update']['p95_ms'],
+                               result['draw']['mean_ms']))
+
+    if result['memory'] is not None:
+        text += '  mem %6.1f MB' % result['memory']['game_mb']
+
+    print(text)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Time the simulation and drawing on synthetic levels.')
+    parser.add_argument('--tiles', type=int, nargs='+', default=TILES)
+    parser.add_argument('--enemies', type=int, nargs='+', default=ENEMIES)
+    parser.add_argument('--ticks', type=int, default=TICKS)
+    parser.add_argument('--streaming', action='store_true', help='also run every case with chunk streaming')
+    parser.add_argument('--batch', action='store_true', help='also run every case with batched enemies')
+    parser.add_argument('--active-region', action='store_true',
+                        help='also run every case updating only enemies near the camera')
+    parser.add_argument('--backend', choices=BACKENDS, default='surface')
+    parser.add_argument('--memory', action='store_true', help='trace memory used by the level start')
+    parser.add_argument('--out', default=os.path.join('benchmarks', 'results.json'))
+    args = parser.parse_args()
+
+    pygame.init()
+    screen = make_backend(args.backend, [WIDTH, HEIGHT], 'bench')
+
+    from assets import AssetRegistry
+    images = AssetRegistry()
+
+    modes = [(False, False, False)]
+
+    if args.streaming:
+        modes.append((True, False, False))
+    if args.batch:
+        modes.append((False, True, False))
+    if args.active_region:
+        modes.append((False, False, True))
+
+    directory = tempfile.mkdtemp(prefix='wiggle-bench-')
+    results = []
+
+    try:
+        for tiles in args.tiles:
+            for enemies in args.enemies:
+                path = write_level(make_level(tiles, enemies), directory)
+
+                for streaming, batch_enemies, active_region in modes:
+                    result = run_case(path, tiles, enemies, args.ticks, images, screen,
+                                      os.path.join(directory, 'cache'), streaming, batch_enemies,
+                                      active_region, args.memory)
+
+                    results.append(result)
+                    report(result)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    with open(args.out, 'w') as f:
+        json.dump({'revision': revision(),
+                   'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                   'python': platform.python_version(),
+                   'pygame': pygame.version.ver,
+                   'platform': platform.platform(),
+                   'chunk_cols': simulation.CHUNK_COLS,
+                   'backend': args.backend,
+                   'results': results}, f, indent=1)
+
+    print('results written to ' + args.out)
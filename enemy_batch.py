@@ -0,0 +1,213 @@
+# Imports
+import numpy as np
+from array import array
+from simulation import GRID_SIZE, HEIGHT
+
+
+# Batched enemy update
+#
+# Runs Enemy.update for every enemy of one type at once on NumPy arrays,
+# testing against the level's tile grid instead of the collision rects.
+# The sprites stay in the enemies group as views: the rect of every enemy in
+# the activity region, and the animation clip of those that turned around,
+# are written back after each step so drawing and hero collisions work as
+# usual.
+#
+# Rewind snapshots are packed from the arrays too: an EnemyPacker keeps the
+# snapshot fields of the whole roster and only copies in the columns the
+# batches change, so a snapshot costs a few array copies, not a pass over
+# every sprite.
+class EnemyBatch:
+
+    def __init__(self, game, sprites, falls):
+        self.game = game
+        self.sprites = list(sprites)
+        self.falls = falls
+
+        level = game.level
+        self.tiles = np.frombuffer(level.tiles, dtype=np.uint8).reshape(level.cols, level.rows)
+
+        self.pull()
+
+    def pull(self):
+        sprites = self.sprites
+
+        self.x = np.array([s.rect.x for s in sprites], dtype=np.int64)
+        self.y = np.array([s.rect.y for s in sprites], dtype=np.int64)
+        self.w = np.array([s.rect.width for s in sprites], dtype=np.int64)
+        self.h = np.array([s.rect.height for s in sprites], dtype=np.int64)
+        self.vx = np.array([s.vx for s in sprites], dtype=np.float64)
+        self.vy = np.array([s.vy for s in sprites], dtype=np.float64)
+        self.last_x = np.array([s.last_pos[0] for s in sprites], dtype=np.int64)
+        self.last_y = np.array([s.last_pos[1] for s in sprites], dtype=np.int64)
+        self.clip = np.array([s.clip for s in sprites], dtype=np.int64)
+        self.alive = np.array([s.alive() for s in sprites], dtype=bool)
+
+        size = self.game.enemy_hash.cell_size
+        self.cells = np.stack([self.x // size, self.y // size,
+                               (self.x + self.w - 1) // size, (self.y + self.h - 1) // size])
+
+    def push(self):
+        for i, sprite in enumerate(self.sprites):
+            sprite.rect.x = int(self.x[i])
+            sprite.rect.y = int(self.y[i])
+            sprite.vx = self.vx[i].item()
+            sprite.vy = self.vy[i].item()
+
+    def solid_at(self, cols, rows):
+        cols_n, rows_n = self.tiles.shape
+        inside = (cols >= 0) & (cols < cols_n) & (rows >= 0) & (rows < rows_n)
+
+        return inside & (self.tiles[np.clip(cols, 0, cols_n - 1), np.clip(rows, 0, rows_n - 1)] != 0)
+
+    def any_solid(self, cols, first_row, last_row):
+        hit = np.zeros(len(cols), dtype=bool)
+
+        for k in range(int((last_row - first_row).max(initial=0)) + 1):
+            rows = first_row + k
+            hit |= (rows <= last_row) & self.solid_at(cols, rows)
+
+        return hit
+
+    def any_solid_row(self, rows, first_col, last_col):
+        hit = np.zeros(len(rows), dtype=bool)
+
+        for k in range(int((last_col - first_col).max(initial=0)) + 1):
+            cols = first_col + k
+            hit |= (cols <= last_col) & self.solid_at(cols, rows)
+
+        return hit
+
+    def move_and_check_platforms(self, m):
+        x, y, w, h, vx, vy = self.x[m], self.y[m], self.w[m], self.h[m], self.vx[m], self.vy[m]
+
+        x = np.floor(x + vx + 0.5).astype(np.int64)
+        lead = np.where(vx > 0, (x + w - 1) // GRID_SIZE, x // GRID_SIZE)
+        hit = (vx != 0) & self.any_solid(lead, y // GRID_SIZE, (y + h - 1) // GRID_SIZE)
+
+        x = np.where(hit & (vx > 0), lead * GRID_SIZE - w, x)
+        x = np.where(hit & (vx < 0), (lead + 1) * GRID_SIZE, x)
+        vx = np.where(hit, -vx, vx)
+
+        y = np.floor(y + vy + 0.5).astype(np.int64)
+        lead = np.where(vy > 0, (y + h - 1) // GRID_SIZE, y // GRID_SIZE)
+        hit = (vy != 0) & self.any_solid_row(lead, x // GRID_SIZE, (x + w - 1) // GRID_SIZE)
+
+        y = np.where(hit & (vy > 0), lead * GRID_SIZE - h, y)
+        y = np.where(hit & (vy < 0), (lead + 1) * GRID_SIZE, y)
+        vy = np.where(hit, 0.0, vy)
+
+        self.x[m], self.y[m], self.vx[m], self.vy[m] = x, y, vx, vy
+
+    def check_world_edges(self, m):
+        x, y, w, vx = self.x[m], self.y[m], self.w[m], self.vx[m]
+        world_width = self.game.world_width
+
+        left = x < 0
+        right = ~left & (x + w > world_width)
+        fallen = ~left & ~right & (y > HEIGHT)
+
+        x = np.where(left, 0, np.where(right, world_width - w, x))
+        vx = np.where(left | right, -vx, vx)
+
+        self.x[m], self.vx[m] = x, vx
+
+        for i in np.flatnonzero(m)[fallen]:
+            self.alive[i] = False
+            self.sprites[i].kill()
+            self.game.enemy_hash.remove(self.sprites[i])
+
+    def check_platform_edges(self, m):
+        x, y, w, h, vx = self.x[m], self.y[m], self.w[m], self.h[m], self.vx[m]
+
+        first_row = (y + 2) // GRID_SIZE
+        last_row = (y + 1 + h) // GRID_SIZE
+
+        left_ok = (vx <= 0) & self.any_solid(x // GRID_SIZE, first_row, last_row)
+        right_ok = (vx >= 0) & self.any_solid((x + w - 1) // GRID_SIZE, first_row, last_row)
+
+        self.vx[m] = np.where(left_ok | right_ok, vx, -vx)
+
+    def animate(self, m):
+        clip = self.clip & ~1 | (self.vx > 0)
+        turned = np.flatnonzero(m & (clip != self.clip))
+
+        for i, value in zip(turned.tolist(), clip[turned].tolist()):
+            self.sprites[i].clip = value
+
+        self.clip[turned] = clip[turned]
+
+    def update(self):
+        m = self.alive.copy()
+        bounds = self.game.activity_bounds()
+
+        if bounds is not None:
+            m &= (self.x + self.w > bounds[0]) & (self.x < bounds[1])
+
+        self.last_x[m] = self.x[m]
+        self.last_y[m] = self.y[m]
+
+        if self.falls:
+            self.vy[m] = np.minimum(self.vy[m] + self.game.gravity, self.game.terminal_velocity)
+
+        self.move_and_check_platforms(m)
+        self.check_world_edges(m)
+        m &= self.alive
+
+        if self.falls:
+            self.check_platform_edges(m)
+
+        self.animate(m)
+
+        moved = np.flatnonzero(m)
+
+        for i, x, y in zip(moved.tolist(), self.x[moved].tolist(), self.y[moved].tolist()):
+            sprite = self.sprites[i]
+            sprite.last_pos = sprite.rect.topleft
+            sprite.rect.x = x
+            sprite.rect.y = y
+
+        self.rebucket()
+
+    def rebucket(self):
+        size = self.game.enemy_hash.cell_size
+        cells = np.stack([self.x // size, self.y // size,
+                          (self.x + self.w - 1) // size, (self.y + self.h - 1) // size])
+
+        for i in np.flatnonzero(self.alive & (cells != self.cells).any(axis=0)):
+            self.game.enemy_hash.move(self.sprites[i])
+
+        self.cells = cells
+
+
+class EnemyPacker:
+
+    def __init__(self, roster, batches, ints, floats):
+        self.batches = batches
+        self.ints = np.array([[e.rect.x, e.rect.y, e.last_pos[0], e.last_pos[1], e.clip, e.phase, e.alive()]
+                              for e in roster], dtype=np.int64).reshape(len(roster), ints)
+        self.floats = np.array([[e.vx, e.vy] for e in roster], dtype=np.float64).reshape(len(roster), floats)
+
+        position = {id(e): i for i, e in enumerate(roster)}
+        self.indices = [np.array([position[id(s)] for s in batch.sprites], dtype=np.int64) for batch in batches]
+
+    def pack(self):
+        ints = self.ints.copy()
+        floats = self.floats.copy()
+
+        for batch, i in zip(self.batches, self.indices):
+            ints[i, 0] = batch.x
+            ints[i, 1] = batch.y
+            ints[i, 2] = batch.last_x
+            ints[i, 3] = batch.last_y
+            ints[i, 4] = batch.clip
+            ints[i, 6] = batch.alive
+            floats[i, 0] = batch.vx
+            floats[i, 1] = batch.vy
+
+        packed_ints = array('q')
+        packed_floats = array('d')
+        packed_ints.frombytes(ints.tobytes())
+        packed_floats.frombytes(floats.tobytes())
+
+        return packed_ints, packed_floats
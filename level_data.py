@@ -0,0 +1,290 @@
+# Imports
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+import threading
+from array import array
+from collections import Counter, namedtuple
+
+
+# Compiled level format
+#
+# header, entity counts, one tile byte per cell (column-major), then an
+# int32 (x, y) table for each entity kind in ENTITY_KEYS order
+MAGIC = b'WGLV'
+VERSION = 1
+CACHE_DIR = os.path.join('assets', 'levels', '.cache')
+
+HEADER = struct.Struct('<4sHIIIIiidd')
+
+# Tile kinds
+EMPTY = 0
+GRASS = 1
+BLOCK = 2
+DIRT = 3
+
+TILE_KEYS = [('grass_locs', GRASS),
+             ('block_locs', BLOCK),
+             ('dirt_locs', DIRT)]
+
+ENTITY_KEYS = [('flag_locs', 'flag'),
+               ('gold_locs', 'gold'),
+               ('bronze_locs', 'bronze'),
+               ('spikeman_locs', 'spikeman'),
+               ('flyman_locs', 'flyman')]
+
+COUNTS = struct.Struct('<%dI' % len(ENTITY_KEYS))
+
+# Level diffs
+#
+# tiles lists (x, y, old kind, new kind) for every cell that changed and
+# entities maps each kind whose locations changed to (removed, added) lists.
+# resized is set when the level or its tile grid changed size.
+LevelDiff = namedtuple('LevelDiff', ['tiles', 'entities', 'resized'])
+
+
+class LevelData:
+
+    def __init__(self, width, height, cols, rows, start, gravity, terminal_velocity, tiles, entities):
+        self.width = width
+        self.height = height
+        self.cols = cols
+        self.rows = rows
+        self.start = start
+        self.gravity = gravity
+        self.terminal_velocity = terminal_velocity
+        self.tiles = tiles
+        self.entities = entities
+
+    def tile(self, x, y):
+        if 0 <= x < self.cols and 0 <= y < self.rows:
+            return self.tiles[x * self.rows + y]
+
+        return EMPTY
+
+    def tile_locs(self, first_col=0, last_col=None):
+        if last_col is None:
+            last_col = self.cols
+
+        rows = self.rows
+        tiles = self.tiles
+
+        for x in range(max(first_col, 0), min(last_col, self.cols)):
+            for y in range(rows):
+                kind = tiles[x * rows + y]
+
+                if kind != EMPTY:
+                    yield x, y, kind
+
+    def solid_rects(self, first_col=0, last_col=None):
+        if last_col is None:
+            last_col = self.cols
+
+        first_col = max(first_col, 0)
+        last_col = min(last_col, self.cols)
+
+        rows = self.rows
+        tiles = self.tiles
+        used = bytearray((last_col - first_col) * rows)
+        rects = []
+
+        def free(x, y):
+            return tiles[x * rows + y] != EMPTY and not used[(x - first_col) * rows + y]
+
+        for y in range(rows):
+            for x in range(first_col, last_col):
+                if not free(x, y):
+                    continue
+
+                w = 1
+                while x + w < last_col and free(x + w, y):
+                    w += 1
+
+                h = 1
+                while y + h < rows and all(free(x + i, y + h) for i in range(w)):
+                    h += 1
+
+                for i in range(w):
+                    for j in range(h):
+                        used[(x + i - first_col) * rows + y + j] = 1
+
+                rects.append((x, y, w, h))
+
+        return rects
+
+
+# Compiling
+def compile_json(data):
+    locs = [(loc, kind) for key, kind in TILE_KEYS for loc in data.get(key, []) if len(loc) == 2]
+
+    cols = max([data['width']] + [loc[0] + 1 for loc, kind in locs])
+    rows = max([data['height']] + [loc[1] + 1 for loc, kind in locs])
+
+    tiles = bytearray(cols * rows)
+
+    for loc, kind in locs:
+        if loc[0] < 0 or loc[1] < 0:
+            raise ValueError('tile outside level grid: ' + str(loc))
+
+        tiles[loc[0] * rows + loc[1]] = kind
+
+    entities = {}
+
+    for key, name in ENTITY_KEYS:
+        entities[name] = [(loc[0], loc[1]) for loc in data.get(key, []) if len(loc) == 2]
+
+    return LevelData(data['width'], data['height'], cols, rows, tuple(data['start']),
+                     data['gravity'], data['terminal_velocity'], tiles, entities)
+
+def to_bytes(level):
+    parts = [HEADER.pack(MAGIC, VERSION, level.width, level.height, level.cols, level.rows,
+                         level.start[0], level.start[1], level.gravity, level.terminal_velocity),
+             COUNTS.pack(*[len(level.entities[name]) for key, name in ENTITY_KEYS]),
+             bytes(level.tiles)]
+
+    for key, name in ENTITY_KEYS:
+        table = array('i', [n for loc in level.entities[name] for n in loc])
+
+        if sys.byteorder == 'big':
+            table.byteswap()
+
+        parts.append(table.tobytes())
+
+    return b''.join(parts)
+
+def from_buffer(buffer):
+    view = memoryview(buffer)
+
+    if len(view) < HEADER.size + COUNTS.size:
+        raise ValueError('truncated level file')
+
+    magic, version, width, height, cols, rows, start_x, start_y, gravity, terminal_velocity = HEADER.unpack_from(view)
+
+    if magic != MAGIC or version != VERSION:
+        raise ValueError('not a compiled level (version ' + str(VERSION) + ')')
+
+    counts = COUNTS.unpack_from(view, HEADER.size)
+    offset = HEADER.size + COUNTS.size
+
+    if len(view) != offset + cols * rows + 8 * sum(counts):
+        raise ValueError('truncated level file')
+
+    tiles = view[offset:offset + cols * rows]
+    offset += cols * rows
+
+    entities = {}
+
+    for (key, name), count in zip(ENTITY_KEYS, counts):
+        table = array('i')
+        table.frombytes(view[offset:offset + 8 * count])
+        offset += 8 * count
+
+        if sys.byteorder == 'big':
+            table.byteswap()
+
+        entities[name] = list(zip(table[0::2], table[1::2]))
+
+    return LevelData(width, height, cols, rows, (start_x, start_y), gravity, terminal_velocity, tiles, entities)
+
+def write_level(level, out_path):
+    tmp_path = out_path + '.' + str(os.getpid()) + '.' + str(threading.get_ident()) + '.tmp'
+
+    with open(tmp_path, 'wb') as f:
+        f.write(to_bytes(level))
+
+    os.replace(tmp_path, out_path)
+
+def compile_level(json_path, out_path):
+    with open(json_path) as f:
+        level = compile_json(json.load(f))
+
+    write_level(level, out_path)
+
+    return level
+
+
+# Diffing
+def diff_levels(old, new):
+    tiles = []
+
+    if old.rows == new.rows:
+        rows = old.rows
+        empty = bytes(rows)
+
+        for x in range(max(old.cols, new.cols)):
+            before = old.tiles[x * rows:(x + 1) * rows] if x < old.cols else empty
+            after = new.tiles[x * rows:(x + 1) * rows] if x < new.cols else empty
+
+            if before != after:
+                for y in range(rows):
+                    if before[y] != after[y]:
+                        tiles.append((x, y, before[y], after[y]))
+    else:
+        for x in range(max(old.cols, new.cols)):
+            for y in range(max(old.rows, new.rows)):
+                if old.tile(x, y) != new.tile(x, y):
+                    tiles.append((x, y, old.tile(x, y), new.tile(x, y)))
+
+    entities = {}
+
+    for key, name in ENTITY_KEYS:
+        if old.entities[name] != new.entities[name]:
+            before = Counter(old.entities[name])
+            after = Counter(new.entities[name])
+            entities[name] = (list((before - after).elements()), list((after - before).elements()))
+
+    resized = (old.width, old.height, old.cols, old.rows) != (new.width, new.height, new.cols, new.rows)
+
+    return LevelDiff(tiles, entities, resized)
+
+
+# Loading
+loaded = {}
+
+def map_file(path):
+    with open(path, 'rb') as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+def load_level(path, cache_dir=CACHE_DIR):
+    if path.endswith('.lvl'):
+        return from_buffer(map_file(path))
+
+    with open(path, 'rb') as f:
+        source = f.read()
+
+    key = hashlib.sha1(source).hexdigest()
+
+    if key in loaded:
+        return loaded[key]
+
+    cache_path = os.path.join(cache_dir, key + '.lvl')
+    level = None
+
+    if os.path.exists(cache_path):
+        try:
+            level = from_buffer(map_file(cache_path))
+        except (OSError, ValueError):
+            level = None
+
+    if level is None:
+        level = compile_json(json.loads(source))
+
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            write_level(level, cache_path)
+        except OSError:
+            pass
+
+    loaded[key] = level
+
+    return level
+
+
+if __name__ == '__main__':
+    for json_path in sys.argv[1:]:
+        out_path = os.path.splitext(json_path)[0] + '.lvl'
+        level = compile_level(json_path, out_path)
+        print(out_path + ': ' + str(level.cols) + 'x' + str(level.rows) + ' tiles')
@@ -0,0 +1,160 @@
+# Imports
+import csv
+import json
+import time
+from collections import deque
+
+
+# Profiler settings
+#
+# Each frame is split into named phases by calling phase() as the main loop
+# moves on; a phase may be entered several times per frame and its times are
+# summed. Work nested inside a phase, like collision tests during the update,
+# is accumulated separately with add() or through a timed() wrapper.
+# Measurements only some frames have, like the latency of an input shown in
+# that frame, are kept with sample() and averaged over the frames that have
+# them.
+FRAMES = 600
+PHASES = ['input', 'update', 'draw', 'hud', 'overlay', 'display', 'wait']
+
+
+class FrameProfiler:
+
+    def __init__(self, size=FRAMES):
+        self.frames = deque(maxlen=size)
+        self.count = 0
+        self.start = None
+        self.name = None
+        self.phase_start = None
+        self.segments = []
+        self.nested = {}
+        self.samples = {}
+
+    def frame(self):
+        now = time.perf_counter()
+
+        if self.start is not None:
+            self.close(now)
+            self.frames.append((self.count, self.start, now - self.start, self.segments, self.nested, self.samples))
+            self.count += 1
+
+        self.start = now
+        self.name = None
+        self.phase_start = now
+        self.segments = []
+        self.nested = {}
+        self.samples = {}
+
+    def phase(self, name):
+        now = time.perf_counter()
+        self.close(now)
+
+        self.name = name
+        self.phase_start = now
+
+    def close(self, now):
+        if self.name is not None:
+            self.segments.append((self.name, self.phase_start, now - self.phase_start))
+
+    def add(self, name, seconds):
+        self.nested[name] = self.nested.get(name, 0.0) + seconds
+
+    def timed(self, name, function):
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.add(name, time.perf_counter() - start)
+
+        return wrapper
+
+    def sample(self, name, seconds):
+        self.samples[name] = max(self.samples.get(name, 0.0), seconds)
+
+    def sample_averages(self):
+        totals = {}
+        counts = {}
+
+        for record in self.frames:
+            for name, value in record[5].items():
+                totals[name] = totals.get(name, 0.0) + value
+                counts[name] = counts.get(name, 0) + 1
+
+        return {name: totals[name] / counts[name] for name in totals}
+
+    def totals(self, record):
+        totals = dict.fromkeys(PHASES, 0.0)
+
+        for name, start, duration in record[3]:
+            totals[name] = totals.get(name, 0.0) + duration
+
+        return totals
+
+    def averages(self, count=60):
+        records = list(self.frames)[-count:]
+        averages = {}
+
+        for record in records:
+            for name, value in self.totals(record).items():
+                averages[name] = averages.get(name, 0.0) + value / len(records)
+
+            for name, value in record[4].items():
+                averages[name] = averages.get(name, 0.0) + value / len(records)
+
+        frame_time = sum(record[2] for record in records) / max(len(records), 1)
+
+        return frame_time, averages
+
+    def nested_names(self, field=4):
+        names = set()
+
+        for record in self.frames:
+            names.update(record[field])
+
+        return sorted(names)
+
+    def save_csv(self, path):
+        phases = list(PHASES)
+
+        for record in self.frames:
+            for name, start, duration in record[3]:
+                if name not in phases:
+                    phases.append(name)
+
+        nested = self.nested_names()
+        samples = self.nested_names(5)
+
+        with open(path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['frame', 'start_ms', 'frame_ms'] + [name + '_ms' for name in phases + nested + samples])
+
+            for record in self.frames:
+                totals = self.totals(record)
+                row = [record[0], '%.3f' % (1000 * record[1]), '%.3f' % (1000 * record[2])]
+                row += ['%.3f' % (1000 * totals.get(name, 0.0)) for name in phases]
+                row += ['%.3f' % (1000 * record[4].get(name, 0.0)) for name in nested]
+                row += ['%.3f' % (1000 * record[5][name]) if name in record[5] else '' for name in samples]
+                writer.writerow(row)
+
+    def save_trace(self, path):
+        events = []
+
+        for index, start, duration, segments, nested, samples in self.frames:
+            events.append({'name': 'frame', 'ph': 'X', 'pid': 1, 'tid': 1,
+                           'ts': 1e6 * start, 'dur': 1e6 * duration, 'args': {'frame': index}})
+
+            for name, phase_start, phase_duration in segments:
+                events.append({'name': name, 'ph': 'X', 'pid': 1, 'tid': 2,
+                               'ts': 1e6 * phase_start, 'dur': 1e6 * phase_duration})
+
+            if len(nested) > 0:
+                events.append({'name': 'nested', 'ph': 'C', 'pid': 1, 'ts': 1e6 * start,
+                               'args': {name: 1000 * value for name, value in nested.items()}})
+
+            for name, value in samples.items():
+                events.append({'name': name, 'ph': 'C', 'pid': 1, 'ts': 1e6 * start, 'args': {'ms': 1000 * value}})
+
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
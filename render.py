@@ -0,0 +1,505 @@
+# Imports
+import math
+import os
+import weakref
+import pygame
+from collections import OrderedDict
+
+
+# Render backends
+#
+# The front-end draws through one of these. 'surface' blits onto the display
+# surface as before. 'renderer' uploads every surface once as an SDL texture
+# and draws with texture copies; subsurfaces such as atlas frames are drawn
+# from their parent's texture, so runs of sprites from one atlas page use a
+# single texture and SDL can batch the copies. It works with SDL's software
+# renderer as well as the accelerated ones. Textures are kept for the
+# MAX_TEXTURES surfaces drawn most recently; large surfaces that are thrown
+# away, like baked tile chunks, should be handed to release() so their
+# texture does not keep them alive.
+BACKENDS = ['surface', 'renderer']
+MAX_TEXTURES = 256
+
+# Render scale
+#
+# The world can be drawn at a fraction of the window resolution and scaled up
+# once per frame; the HUD and menus are drawn over it afterwards at the full
+# resolution so text stays sharp. Positions and sizes given to a scaled target
+# stay in window pixels. 'nearest' needs a whole-number upscale factor,
+# 'smooth' takes any scale. AUTO_SCALES are the steps auto mode moves through.
+FILTERS = ['nearest', 'smooth']
+AUTO_SCALES = {'nearest': [1.0, 0.5, 0.25],
+               'smooth': [1.0, 0.75, 0.5]}
+
+
+class SurfaceBackend:
+
+    partial_updates = True
+
+    def __init__(self, size, title):
+        self.surface = pygame.display.set_mode(size)
+        pygame.display.set_caption(title)
+
+    def get_width(self):
+        return self.surface.get_width()
+
+    def get_height(self):
+        return self.surface.get_height()
+
+    def convert_alpha(self, surface):
+        return surface.convert_alpha()
+
+    def blit(self, image, pos, area=None):
+        self.surface.blit(image, pos, area)
+
+    def blits(self, pairs):
+        self.surface.blits(pairs, False)
+
+    def fill(self, color, rect=None):
+        self.surface.fill(color, rect)
+
+    def line(self, color, start, end, width=1):
+        pygame.draw.line(self.surface, color, start, end, width)
+
+    def set_clip(self, rect):
+        self.surface.set_clip(rect)
+
+    def present(self, dirty=None):
+        if dirty is None:
+            pygame.display.update()
+        else:
+            pygame.display.update(dirty)
+
+    def snapshot(self):
+        return self.surface.copy()
+
+    def release(self, surface):
+        pass
+
+    def release_all(self):
+        pass
+
+    def scaled(self, scale, filter):
+        return ScaledSurface(self, scale, filter)
+
+
+class RendererBackend:
+
+    partial_updates = False
+
+    def __init__(self, size, title, accelerated=-1, max_textures=MAX_TEXTURES):
+        from pygame._sdl2.video import Window, Renderer
+
+        os.environ.setdefault('SDL_RENDER_BATCHING', '1')
+
+        self.size = tuple(size)
+        self.window = Window(title, self.size)
+        self.renderer = Renderer(self.window, accelerated=accelerated)
+        self.max_textures = max_textures
+        self.textures = OrderedDict()
+
+    def get_width(self):
+        return self.size[0]
+
+    def get_height(self):
+        return self.size[1]
+
+    def convert_alpha(self, surface):
+        return surface
+
+    def texture(self, image):
+        from pygame._sdl2.video import Texture
+
+        root = image.get_abs_parent()
+        texture = self.textures.get(root)
+
+        if texture is None:
+            texture = Texture.from_surface(self.renderer, root)
+            self.textures[root] = texture
+
+            if len(self.textures) > self.max_textures:
+                self.textures.popitem(last=False)
+        else:
+            self.textures.move_to_end(root)
+
+        return texture, image.get_abs_offset()
+
+    def blit(self, image, pos, area=None):
+        texture, (x, y) = self.texture(image)
+
+        if area is None:
+            w, h = image.get_size()
+        else:
+            area = pygame.Rect(area)
+            x, y, w, h = x + area.x, y + area.y, area.width, area.height
+
+        texture.draw((x, y, w, h), (int(pos[0]), int(pos[1]), w, h))
+
+    def blits(self, pairs):
+        for image, pos in pairs:
+            self.blit(image, pos)
+
+    def fill(self, color, rect=None):
+        self.renderer.draw_color = pygame.Color(color)
+
+        if rect is None:
+            self.renderer.clear()
+        else:
+            self.renderer.fill_rect(rect)
+
+    def line(self, color, start, end, width=1):
+        self.renderer.draw_color = pygame.Color(color)
+        self.renderer.draw_line(start, end)
+
+    def set_clip(self, rect):
+        pass
+
+    def present(self, dirty=None):
+        self.renderer.present()
+
+    def snapshot(self):
+        return self.renderer.to_surface()
+
+    def release(self, surface):
+        self.textures.pop(surface.get_abs_parent(), None)
+
+    def release_all(self):
+        self.textures.clear()
+
+    def scaled(self, scale, filter):
+        return ScaledRenderer(self, scale, filter)
+
+
+# Scaled targets
+def check_scale(scale, filter):
+    if filter not in FILTERS:
+        raise ValueError('unknown render filter: ' + str(filter))
+    if not 0 < scale <= 1:
+        raise ValueError('render scale must be above 0 and at most 1: ' + str(scale))
+    if filter == 'nearest' and abs(1 / scale - round(1 / scale)) > 1e-6:
+        raise ValueError('nearest filtering needs a whole-number upscale: ' + str(scale))
+
+def scale_rect(rect, scale):
+    rect = pygame.Rect(rect)
+    left = math.floor(rect.left * scale)
+    top = math.floor(rect.top * scale)
+
+    return pygame.Rect(left, top, math.ceil(rect.right * scale) - left, math.ceil(rect.bottom * scale) - top)
+
+
+class ScaledSurface:
+
+    partial_updates = False
+
+    def __init__(self, backend, scale, filter):
+        check_scale(scale, filter)
+
+        self.backend = backend
+        self.scale = scale
+        self.filter = filter
+        self.size = (backend.get_width(), backend.get_height())
+        self.surface = pygame.Surface([math.ceil(self.size[0] * scale), math.ceil(self.size[1] * scale)])
+        self.images = weakref.WeakKeyDictionary()
+
+    def get_width(self):
+        return self.size[0]
+
+    def get_height(self):
+        return self.size[1]
+
+    def image(self, image):
+        scaled = self.images.get(image)
+
+        if scaled is None:
+            size = [max(math.ceil(image.get_width() * self.scale), 1),
+                    max(math.ceil(image.get_height() * self.scale), 1)]
+
+            if image.get_bitsize() >= 24:
+                scaled = pygame.transform.smoothscale(image, size)
+            else:
+                scaled = pygame.transform.scale(image, size)
+
+            self.images[image] = scaled
+
+        return scaled
+
+    def begin(self):
+        pass
+
+    def blit(self, image, pos, area=None):
+        if area is not None:
+            image = image.subsurface(area)
+
+        self.surface.blit(self.image(image), [math.floor(pos[0] * self.scale), math.floor(pos[1] * self.scale)])
+
+    def blits(self, pairs):
+        scale = self.scale
+        self.surface.blits([(self.image(image), (math.floor(pos[0] * scale), math.floor(pos[1] * scale)))
+                            for image, pos in pairs], False)
+
+    def fill(self, color, rect=None):
+        self.surface.fill(color, None if rect is None else scale_rect(rect, self.scale))
+
+    def line(self, color, start, end, width=1):
+        pygame.draw.line(self.surface, color, [start[0] * self.scale, start[1] * self.scale],
+                         [end[0] * self.scale, end[1] * self.scale], max(round(width * self.scale), 1))
+
+    def set_clip(self, rect):
+        self.surface.set_clip(None if rect is None else scale_rect(rect, self.scale))
+
+    def upscale(self):
+        if self.filter == 'nearest':
+            pygame.transform.scale(self.surface, self.size, self.backend.surface)
+        else:
+            pygame.transform.smoothscale(self.surface, self.size, self.backend.surface)
+
+
+class ScaledRenderer:
+
+    partial_updates = False
+
+    def __init__(self, backend, scale, filter):
+        from pygame._sdl2.video import Texture
+
+        check_scale(scale, filter)
+
+        self.backend = backend
+        self.renderer = backend.renderer
+        self.scale = scale
+        self.size = backend.size
+
+        # the filter is fixed when the texture is created
+        quality = os.environ.get('SDL_RENDER_SCALE_QUALITY')
+        os.environ['SDL_RENDER_SCALE_QUALITY'] = '0' if filter == 'nearest' else '1'
+
+        try:
+            self.texture = Texture(self.renderer, [math.ceil(self.size[0] * scale), math.ceil(self.size[1] * scale)],
+                                   target=True)
+        finally:
+            if quality is None:
+                del os.environ['SDL_RENDER_SCALE_QUALITY']
+            else:
+                os.environ['SDL_RENDER_SCALE_QUALITY'] = quality
+
+    def get_width(self):
+        return self.size[0]
+
+    def get_height(self):
+        return self.size[1]
+
+    def begin(self):
+        self.renderer.target = self.texture
+
+    def blit(self, image, pos, area=None):
+        texture, (x, y) = self.backend.texture(image)
+
+        if area is None:
+            w, h = image.get_size()
+        else:
+            area = pygame.Rect(area)
+            x, y, w, h = x + area.x, y + area.y, area.width, area.height
+
+        scale = self.scale
+        texture.draw((x, y, w, h), (math.floor(pos[0] * scale), math.floor(pos[1] * scale),
+                                    math.ceil(w * scale), math.ceil(h * scale)))
+
+    def blits(self, pairs):
+        for image, pos in pairs:
+            self.blit(image, pos)
+
+    def fill(self, color, rect=None):
+        self.renderer.draw_color = pygame.Color(color)
+
+        if rect is None:
+            self.renderer.clear()
+        else:
+            self.renderer.fill_rect(scale_rect(rect, self.scale))
+
+    def line(self, color, start, end, width=1):
+        self.renderer.draw_color = pygame.Color(color)
+        self.renderer.draw_line([start[0] * self.scale, start[1] * self.scale],
+                                [end[0] * self.scale, end[1] * self.scale])
+
+    def set_clip(self, rect):
+        pass
+
+    def upscale(self):
+        self.renderer.target = None
+        self.texture.draw(None, (0, 0) + tuple(self.size))
+
+
+# Static tile layer
+#
+# Platforms and flags never move, so they are baked into chunks of
+# chunk_width pixels once and drawn as a few large blits. With max_chunks the
+# chunks are baked when first drawn and the least recently drawn ones are
+# dropped past that many. Levels more than EAGER_CHUNKS chunks wide are
+# always baked that way, keeping EAGER_CHUNKS, as baking them all up front
+# would take gigabytes.
+EAGER_CHUNKS = 16
+
+
+class StaticLayer:
+
+    def __init__(self, backend, groups, width, height, chunk_width, max_chunks=None):
+        self.backend = backend
+        self.groups = groups
+        self.height = height
+        self.chunk_width = chunk_width
+        self.count = (width + chunk_width - 1) // chunk_width
+
+        if max_chunks is None and self.count > EAGER_CHUNKS:
+            max_chunks = EAGER_CHUNKS
+
+        self.max_chunks = max_chunks
+        self.chunks = OrderedDict()
+
+        if max_chunks is None:
+            for i in range(self.count):
+                self.chunks[i] = self.backend.convert_alpha(pygame.Surface([chunk_width, height], pygame.SRCALPHA))
+
+            for group in groups:
+                for sprite in group:
+                    first = max(sprite.rect.left // chunk_width, 0)
+                    last = min((sprite.rect.right - 1) // chunk_width, self.count - 1)
+
+                    for i in range(first, last + 1):
+                        self.chunks[i].blit(sprite.image, [sprite.rect.x - i * chunk_width, sprite.rect.y])
+
+    def bake(self, i):
+        chunk = self.backend.convert_alpha(pygame.Surface([self.chunk_width, self.height], pygame.SRCALPHA))
+        area = pygame.Rect(i * self.chunk_width, 0, self.chunk_width, self.height)
+
+        for group in self.groups:
+            for sprite in group:
+                if sprite.rect.colliderect(area):
+                    chunk.blit(sprite.image, [sprite.rect.x - area.x, sprite.rect.y])
+
+        return chunk
+
+    def draw(self, surface, offset_x):
+        first = max(offset_x // self.chunk_width, 0)
+        last = min((offset_x + surface.get_width() - 1) // self.chunk_width, self.count - 1)
+
+        for i in range(first, last + 1):
+            chunk = self.chunks.get(i)
+
+            if chunk is None:
+                chunk = self.bake(i)
+                self.chunks[i] = chunk
+
+                if len(self.chunks) > self.max_chunks:
+                    self.backend.release(self.chunks.popitem(last=False)[1])
+            elif self.max_chunks is not None:
+                self.chunks.move_to_end(i)
+
+            surface.blit(chunk, [i * self.chunk_width - offset_x, 0])
+
+    def refresh(self, xs):
+        for i in {x // self.chunk_width for x in xs}:
+            if i in self.chunks:
+                self.backend.release(self.chunks[i])
+                self.chunks[i] = self.bake(i)
+
+
+# World drawing
+#
+# The world is drawn the same way by the game and the benchmarks: the
+# background, then the moving sprites within margin pixels of the view,
+# interpolated by alpha between their last two ticks, with the baked tile
+# layer in between.
+def screen_rect(sprite, offset_x, alpha):
+    x, y = sprite.last_pos
+    x += (sprite.rect.x - x) * alpha
+    y += (sprite.rect.y - y) * alpha
+
+    return pygame.Rect(round(x - offset_x), round(y), sprite.rect.width, sprite.rect.height)
+
+def draw_visible(target, group, offset_x, alpha, margin):
+    view = pygame.Rect(offset_x, 0, target.get_width(), target.get_height()).inflate(2 * margin, 2 * margin)
+
+    target.blits([(sprite.image, screen_rect(sprite, offset_x, alpha))
+                  for sprite in group if sprite.rect.colliderect(view)])
+
+def draw_background(target, background, offset_x):
+    bg_offset_x = -1 * (0.05 * offset_x % background.get_width())
+
+    target.blit(background, [bg_offset_x, 0])
+    target.blit(background, [bg_offset_x + background.get_width(), 0])
+
+def draw_world(target, game, layer, background, offset_x, alpha, margin):
+    draw_background(target, background, offset_x)
+    draw_visible(target, game.player, offset_x, alpha, margin)
+    layer.draw(target, offset_x)
+    draw_visible(target, game.items, offset_x, alpha, margin)
+    draw_visible(target, game.enemies, offset_x, alpha, margin)
+
+
+# Automatic render scale
+#
+# Averages the busy part of each frame, everything but the wait for the next
+# one, over a window of frames. Above HIGH of the budget the scale drops a
+# step; below LOW it goes back up a step. A step up that has to be undone
+# right away doubles the wait before the next try, so a machine that sits
+# between two steps does not flicker between them.
+AUTO_WINDOW = 30
+AUTO_HIGH = 0.9
+AUTO_LOW = 0.5
+
+
+class AutoScale:
+
+    def __init__(self, scales, budget, window=AUTO_WINDOW):
+        self.scales = scales
+        self.budget = budget
+        self.window = window
+        self.index = 0
+        self.total = 0.0
+        self.frames = 0
+        self.patience = window
+        self.calm = 0
+        self.raised = False
+
+    @property
+    def scale(self):
+        return self.scales[self.index]
+
+    def update(self, busy):
+        self.total += busy
+        self.frames += 1
+
+        if self.frames < self.window:
+            return self.scale
+
+        average = self.total / self.frames
+        self.total = 0.0
+        self.frames = 0
+
+        if average > AUTO_HIGH * self.budget and self.index < len(self.scales) - 1:
+            if self.raised:
+                self.patience *= 2
+
+            self.index += 1
+            self.calm = 0
+            self.raised = False
+        elif average < AUTO_LOW * self.budget and self.index > 0:
+            self.calm += self.window
+
+            if self.calm >= self.patience:
+                self.index -= 1
+                self.calm = 0
+                self.raised = True
+        else:
+            self.calm = 0
+            self.raised = False
+
+        return self.scale
+
+
+def make_backend(name, size, title):
+    if name == 'surface':
+        return SurfaceBackend(size, title)
+    elif name == 'renderer':
+        return RendererBackend(size, title)
+
+    raise ValueError('unknown render backend: ' + str(name))
@@ -0,0 +1,293 @@
+# Imports
+import struct
+import sys
+import time
+from simulation import Game, Inputs, FPS, levels, JUMP_BUFFER, COYOTE_TIME, ACTIVE_MARGIN
+
+
+# Input log format
+#
+# header, the jump timing, the activity margin, the level paths, then the
+# per-tick input codes run-length encoded as one code byte followed by the run
+# length as a varint. A margin of NO_REGION means every enemy is updated.
+# Version 1 logs have no jump timing and play back with it turned off, and
+# logs before version 3 were recorded with the activity region at
+# ACTIVE_MARGIN.
+MAGIC = b'WGIN'
+VERSION = 3
+
+HEADER = struct.Struct('<4sHqIBH')
+TIMING = struct.Struct('<BB')
+REGION = struct.Struct('<H')
+PATH = struct.Struct('<H')
+
+# Input code bits
+LEFT = 1
+RIGHT = 2
+JUMP = 4
+BEGIN = 8
+RESTART = 16
+RETRY = 32
+REWIND = 64
+
+# Game flags
+STREAMING = 1
+BATCH_ENEMIES = 2
+NO_REGION = 0xffff
+
+
+def encode(inputs, begin=False, restart=False, retry=False, rewind=False):
+    code = 0
+
+    if inputs.move < 0:
+        code |= LEFT
+    elif inputs.move > 0:
+        code |= RIGHT
+
+    if inputs.jump:
+        code |= JUMP
+    if begin:
+        code |= BEGIN
+    if restart:
+        code |= RESTART
+    if retry:
+        code |= RETRY
+    if rewind:
+        code |= REWIND
+
+    return code
+
+def decode(code):
+    if code & LEFT:
+        move = -1
+    elif code & RIGHT:
+        move = 1
+    else:
+        move = 0
+
+    return (Inputs(move, bool(code & JUMP)), bool(code & BEGIN), bool(code & RESTART),
+            bool(code & RETRY), bool(code & REWIND))
+
+
+class InputLog:
+
+    def __init__(self, seed=0, level=0, levels=levels, streaming=False, batch_enemies=False, runs=None,
+                 jump_buffer=JUMP_BUFFER, coyote_time=COYOTE_TIME, activity_margin=None):
+        self.seed = seed
+        self.level = level
+        self.levels = list(levels)
+        self.streaming = streaming
+        self.batch_enemies = batch_enemies
+        self.runs = [] if runs is None else runs
+        self.jump_buffer = jump_buffer
+        self.coyote_time = coyote_time
+        self.activity_margin = activity_margin
+
+    def ticks(self):
+        return sum(count for code, count in self.runs)
+
+    def codes(self):
+        for code, count in self.runs:
+            for i in range(count):
+                yield code
+
+
+class Recorder:
+
+    def __init__(self, game):
+        self.log = InputLog(game.seed, game.current_level, game.levels, game.streaming, game.batch_enemies,
+                            jump_buffer=game.jump_buffer, coyote_time=game.coyote_time,
+                            activity_margin=game.activity_margin)
+        self.pending = 0
+
+    def begin(self):
+        self.pending |= BEGIN
+
+    def restart(self):
+        self.pending |= RESTART
+
+    def retry(self):
+        self.pending |= RETRY
+
+    def rewind(self):
+        self.pending |= REWIND
+
+    def record(self, inputs):
+        code = encode(inputs) | self.pending
+        self.pending = 0
+
+        runs = self.log.runs
+
+        if len(runs) > 0 and runs[-1][0] == code:
+            runs[-1][1] += 1
+        else:
+            runs.append([code, 1])
+
+    def save(self, path):
+        save_log(self.log, path)
+
+
+# Serialising
+def to_bytes(log):
+    flags = 0
+
+    if log.streaming:
+        flags |= STREAMING
+    if log.batch_enemies:
+        flags |= BATCH_ENEMIES
+
+    if log.activity_margin is None:
+        margin = NO_REGION
+    else:
+        margin = log.activity_margin
+
+    parts = [HEADER.pack(MAGIC, VERSION, log.seed, log.level, flags, len(log.levels)),
+             TIMING.pack(log.jump_buffer, log.coyote_time), REGION.pack(margin)]
+
+    for path in log.levels:
+        path = path.encode('utf-8')
+        parts.append(PATH.pack(len(path)) + path)
+
+    out = bytearray()
+
+    for code, count in log.runs:
+        out.append(code)
+
+        while count >= 0x80:
+            out.append(count & 0x7f | 0x80)
+            count >>= 7
+
+        out.append(count)
+
+    parts.append(bytes(out))
+
+    return b''.join(parts)
+
+def from_bytes(buffer):
+    if len(buffer) < HEADER.size:
+        raise ValueError('truncated input log')
+
+    magic, version, seed, level, flags, count = HEADER.unpack_from(buffer)
+
+    if magic != MAGIC or version not in [1, 2, VERSION]:
+        raise ValueError('not an input log (version ' + str(VERSION) + ')')
+
+    offset = HEADER.size
+    paths = []
+
+    try:
+        if version == 1:
+            jump_buffer = coyote_time = 0
+        else:
+            jump_buffer, coyote_time = TIMING.unpack_from(buffer, offset)
+            offset += TIMING.size
+
+        if version < 3:
+            margin = ACTIVE_MARGIN
+        else:
+            margin, = REGION.unpack_from(buffer, offset)
+            offset += REGION.size
+
+            if margin == NO_REGION:
+                margin = None
+
+        for i in range(count):
+            size, = PATH.unpack_from(buffer, offset)
+            offset += PATH.size
+            paths.append(bytes(buffer[offset:offset + size]).decode('utf-8'))
+            offset += size
+
+        runs = []
+
+        while offset < len(buffer):
+            code = buffer[offset]
+            offset += 1
+            length = shift = 0
+
+            while True:
+                byte = buffer[offset]
+                offset += 1
+                length |= (byte & 0x7f) << shift
+                shift += 7
+
+                if byte < 0x80:
+                    break
+
+            runs.append([code, length])
+    except (IndexError, struct.error):
+        raise ValueError('truncated input log')
+
+    return InputLog(seed, level, paths, bool(flags & STREAMING), bool(flags & BATCH_ENEMIES), runs,
+                    jump_buffer, coyote_time, margin)
+
+def save_log(log, path):
+    with open(path, 'wb') as f:
+        f.write(to_bytes(log))
+
+def load_log(path):
+    with open(path, 'rb') as f:
+        return from_bytes(f.read())
+
+
+# Replaying
+def new_game(log, images=None):
+    game = Game(images, log.levels, log.seed, log.batch_enemies, log.streaming,
+                jump_buffer=log.jump_buffer, coyote_time=log.coyote_time,
+                activity_margin=log.activity_margin)
+
+    if log.level != 0:
+        game.current_level = log.level
+        game.start_level()
+
+    return game
+
+def play(game, code):
+    inputs, begin, restart, retry, rewind = decode(code)
+
+    if restart:
+        game.restart()
+    if retry:
+        game.retry()
+    if rewind:
+        game.rewind()
+    if begin:
+        game.begin()
+
+    return game.step(inputs)
+
+def replay(log, game=None, realtime=False):
+    if game is None:
+        game = new_game(log)
+
+    start = time.perf_counter()
+    state = game.state()
+
+    for i, code in enumerate(log.codes()):
+        state = play(game, code)
+
+        if realtime:
+            delay = start + (i + 1) / FPS - time.perf_counter()
+
+            if delay > 0:
+                time.sleep(delay)
+
+    return state
+
+
+if __name__ == '__main__':
+    realtime = '--realtime' in sys.argv
+
+    for path in [arg for arg in sys.argv[1:] if arg != '--realtime']:
+        log = load_log(path)
+        game = new_game(log)
+
+        start = time.perf_counter()
+
+        state = replay(log, game, realtime)
+
+        elapsed = time.perf_counter() - start
+        ticks = log.ticks()
+
+        print(path + ': ' + str(ticks) + ' ticks in ' + '%.3f' % elapsed + 's (' +
+              '%.0f' % (ticks / max(elapsed, 1e-9)) + ' ticks/s)')
+        print('  ' + str(state._replace(events=[])))
@@ -0,0 +1,1249 @@
+# Imports
+import pygame
+import random
+import time
+from array import array
+from collections import deque, namedtuple
+from level_data import load_level, diff_levels, EMPTY
+from assets import AssetRegistry, TILE_IMAGES
+from animation import AnimationLibrary, HERO, SLIME, WINGMAN, IDLE, WALK, JUMP
+
+
+# World settings
+GRID_SIZE = 64
+WIDTH = 23 * GRID_SIZE
+HEIGHT = 12 * GRID_SIZE
+FPS = 60
+
+# Stages
+START = 0
+PLAYING = 1
+LOSE = 2
+LEVEL_COMPLETE = 3
+WIN = 4
+
+# Streaming
+#
+# In streaming mode the world is split into chunks of CHUNK_COLS columns and
+# only the chunks within STREAM_MARGIN pixels of the camera are turned into
+# sprites and collision rects. Chunks are released again once they are more
+# than a chunk outside that range.
+CHUNK_COLS = 16
+STREAM_MARGIN = 4 * GRID_SIZE
+
+# Activity region
+#
+# By default every enemy is updated each tick. Passing
+# activity_margin=ACTIVE_MARGIN to Game updates only the hero and the enemies
+# within that many pixels of the camera; the rest freeze in place until the
+# region reaches them, so levels with enemies that must keep patrolling off
+# screen should leave it off. Sleeping enemies are bucketed by ACTIVITY_CELL
+# wide columns so waking them only looks at the buckets the region covers.
+ACTIVE_MARGIN = 8 * GRID_SIZE
+ACTIVITY_CELL = 4 * GRID_SIZE
+
+# Snapshots
+#
+# A snapshot holds everything play changes within a level: the hero, the
+# enemies and items still around, the stage, level index and timers. Enemy
+# fields are packed into flat arrays in the order the level created them, so
+# taking or restoring one copies numbers rather than building sprites; the
+# level is only rebuilt when the snapshot is from another one.
+# In streaming mode enemies are kept the way dormant ones are. While playing,
+# one is kept every REWIND_INTERVAL ticks for the last REWIND_SECONDS.
+# Snapshots keep the level data they were taken on. One whose level file has
+# changed since, through a hot reload or an edit while another level was
+# played, only restores the hero's stats and the timers onto the level built
+# from the file as it is now.
+REWIND_SECONDS = 3
+REWIND_INTERVAL = 10
+ENEMY_INTS = 7
+ENEMY_FLOATS = 2
+
+# Jump timing
+#
+# A jump pressed in the air is kept for JUMP_BUFFER ticks and taken as soon
+# as the hero lands. For COYOTE_TIME ticks after walking off a ledge the hero
+# can still jump as if on the ground. Both are counted in ticks so replays
+# stay exact; 0 turns them off.
+JUMP_BUFFER = 6
+COYOTE_TIME = 6
+
+# Profiling
+#
+# A profiler handed to Game, or set later with set_profiler(), is given the
+# time spent in sprite updates and tile collisions through its add() as
+# 'sprites' and 'collision'. Without one nothing is timed.
+
+# Levels
+levels = ['assets/levels/world-1.json',
+          'assets/levels/world-2.json',
+          'assets/levels/world-3.json']
+
+# Inputs and state
+Inputs = namedtuple('Inputs', ['move', 'jump'])
+NO_INPUT = Inputs(0, False)
+
+State = namedtuple('State', ['tick', 'stage', 'level', 'x', 'y', 'vx', 'vy',
+                             'hearts', 'score', 'gold_coins', 'bronze_coins', 'events'])
+
+Snapshot = namedtuple('Snapshot', ['elapsed', 'stage', 'level', 'data', 'countdown', 'earn_points', 'random',
+                                   'gravity', 'terminal_velocity', 'hero', 'enemies', 'items', 'stream'])
+
+
+# Collision index
+class TileGrid:
+
+    def __init__(self, profiler=None):
+        self.cells = {}
+        self.profiler = profiler
+
+    def add(self, rect):
+        for col in range(rect.left // GRID_SIZE, (rect.right - 1) // GRID_SIZE + 1):
+            for row in range(rect.top // GRID_SIZE, (rect.bottom - 1) // GRID_SIZE + 1):
+                self.cells.setdefault((col, row), []).append(rect)
+
+    def collide(self, rect):
+        if self.profiler is not None:
+            start = time.perf_counter()
+
+        hits = []
+
+        for col in range(rect.left // GRID_SIZE, (rect.right - 1) // GRID_SIZE + 1):
+            for row in range(rect.top // GRID_SIZE, (rect.bottom - 1) // GRID_SIZE + 1):
+                for tile in self.cells.get((col, row), ()):
+                    if tile.colliderect(rect) and tile not in hits:
+                        hits.append(tile)
+
+        if self.profiler is not None:
+            self.profiler.add('collision', time.perf_counter() - start)
+
+        return hits
+
+    def remove(self, rect):
+        for col in range(rect.left // GRID_SIZE, (rect.right - 1) // GRID_SIZE + 1):
+            for row in range(rect.top // GRID_SIZE, (rect.bottom - 1) // GRID_SIZE + 1):
+                cell = self.cells.get((col, row))
+
+                if cell is not None:
+                    cell.remove(rect)
+
+                    if len(cell) == 0:
+                        del self.cells[(col, row)]
+
+    def cut(self, area):
+        for rect in self.collide(area):
+            self.remove(rect)
+
+            top = max(rect.top, area.top)
+            bottom = min(rect.bottom, area.bottom)
+
+            if rect.top < area.top:
+                self.add(pygame.Rect(rect.left, rect.top, rect.width, area.top - rect.top))
+            if rect.bottom > area.bottom:
+                self.add(pygame.Rect(rect.left, area.bottom, rect.width, rect.bottom - area.bottom))
+            if rect.left < area.left:
+                self.add(pygame.Rect(rect.left, top, area.left - rect.left, bottom - top))
+            if rect.right > area.right:
+                self.add(pygame.Rect(area.right, top, rect.right - area.right, bottom - top))
+
+
+# Broad phase for moving entities
+#
+# Sprites are bucketed by the cells their rect overlaps and only rebucketed
+# when that cell range changes. Queries return candidates in the order they
+# were added, which is the same order the sprite groups iterate in.
+class SpatialHash:
+
+    def __init__(self, cell_size=2 * GRID_SIZE):
+        self.cell_size = cell_size
+        self.cells = {}
+        self.ranges = {}
+        self.order = {}
+        self.count = 0
+
+    def cell_range(self, rect):
+        size = self.cell_size
+        return rect.left // size, rect.top // size, (rect.right - 1) // size, (rect.bottom - 1) // size
+
+    def insert(self, sprite, cells):
+        for col in range(cells[0], cells[2] + 1):
+            for row in range(cells[1], cells[3] + 1):
+                self.cells.setdefault((col, row), set()).add(sprite)
+
+    def discard(self, sprite, cells):
+        for col in range(cells[0], cells[2] + 1):
+            for row in range(cells[1], cells[3] + 1):
+                cell = self.cells[(col, row)]
+                cell.discard(sprite)
+
+                if len(cell) == 0:
+                    del self.cells[(col, row)]
+
+    def add(self, sprite):
+        cells = self.cell_range(sprite.rect)
+
+        self.ranges[sprite] = cells
+        self.order[sprite] = self.count
+        self.count += 1
+
+        self.insert(sprite, cells)
+
+    def remove(self, sprite):
+        cells = self.ranges.pop(sprite, None)
+
+        if cells is not None:
+            del self.order[sprite]
+            self.discard(sprite, cells)
+
+    def move(self, sprite):
+        rect = sprite.rect
+        size = self.cell_size
+        cells = rect.left // size, rect.top // size, (rect.right - 1) // size, (rect.bottom - 1) // size
+        old = self.ranges[sprite]
+
+        if cells != old:
+            self.discard(sprite, old)
+            self.insert(sprite, cells)
+            self.ranges[sprite] = cells
+
+    def query(self, rect):
+        found = set()
+        first_col, first_row, last_col, last_row = self.cell_range(rect)
+
+        for col in range(first_col, last_col + 1):
+            for row in range(first_row, last_row + 1):
+                cell = self.cells.get((col, row))
+
+                if cell is not None:
+                    found.update(cell)
+
+        return sorted(found, key=self.order.__getitem__)
+
+
+# Game classes
+class Entity(pygame.sprite.Sprite):
+
+    def __init__(self, game, x, y, image):
+        super().__init__()
+
+        self.game = game
+        self.set_image(image)
+        self.place(x, y, image.get_rect())
+
+    def set_image(self, image):
+        self.image = image
+
+    def place(self, x, y, rect):
+        self.rect = rect
+        self.rect.centerx = x * GRID_SIZE + GRID_SIZE // 2
+        self.rect.centery = y * GRID_SIZE + GRID_SIZE // 2
+        self.last_pos = self.rect.topleft
+
+        self.vx = 0
+        self.vy = 0
+
+    def apply_gravity(self):
+        self.vy += self.game.gravity
+
+        if self.vy > self.game.terminal_velocity:
+            self.vy = self.game.terminal_velocity
+
+
+class AnimatedEntity(Entity):
+
+    def __init__(self, game, x, y, clip):
+        self.clip = clip
+        self.phase = -game.elapsed
+
+        super().__init__(game, x, y, game.animations.frames(clip)[0])
+
+    def set_image(self, image):
+        # frames come from the clip
+        pass
+
+    @property
+    def image(self):
+        return self.game.animations.frame(self.clip, self.game.elapsed + self.phase)
+
+
+class Platform(Entity):
+
+    def __init__(self, game, x, y, image):
+        super().__init__(game, x, y, image)
+
+
+class Flag(Entity):
+
+    def __init__(self, game, x, y, image):
+        super().__init__(game, x, y, image)
+
+
+class Hero(AnimatedEntity):
+
+    def __init__(self, game, x, y):
+        super().__init__(game, x, y, HERO)
+
+        self.speed = 5
+        self.jump_power = 13
+        self.vx = 0
+        self.vy = 0
+        self.facing_right = True
+        self.jumping = False
+        self.jump_timer = 0
+        self.coyote_timer = 0
+
+        self.hearts = 3
+        self.gold_coins = 0
+        self.bronze_coins = 0
+        self.score = 0
+
+        self.hurt_timer = 0
+
+    def move_to(self, x, y):
+        self.rect.centerx = x * GRID_SIZE + GRID_SIZE // 2
+        self.rect.centery = y * GRID_SIZE + GRID_SIZE // 2
+        self.last_pos = self.rect.topleft
+        self.jump_timer = 0
+        self.coyote_timer = 0
+
+    def move_right(self):
+        self.vx = self.speed
+        self.facing_right = True
+
+    def move_left(self):
+        self.vx = -self.speed
+        self.facing_right = False
+
+    def stop(self):
+        self.vx = 0
+
+    def on_ground(self):
+        self.rect.y += 2
+        hits = self.game.tile_grid.collide(self.rect)
+        self.rect.y -= 2
+
+        return len(hits) > 0
+
+    def jump(self):
+        if self.coyote_timer > 0 or self.on_ground():
+            self.vy = -1 * self.jump_power
+            self.jumping = True
+            self.jump_timer = 0
+            self.coyote_timer = 0
+            self.game.events.append('jump')
+
+    def buffer_jump(self):
+        self.jump_timer = self.game.jump_buffer + 1
+
+    def check_jump(self):
+        if self.jump_timer > 0:
+            self.jump_timer -= 1
+            self.jump()
+
+        if self.coyote_timer > 0:
+            self.coyote_timer -= 1
+
+    def move_and_check_platforms(self):
+        self.rect.x += self.vx
+
+        hits = self.game.tile_grid.collide(self.rect)
+
+        for hit in hits:
+            if self.vx > 0:
+                self.rect.right = hit.left
+            elif self.vx < 0:
+                self.rect.left = hit.right
+
+        self.rect.y += self.vy
+
+        hits = self.game.tile_grid.collide(self.rect)
+
+        for hit in hits:
+            if self.vy > 0:
+                self.rect.bottom = hit.top
+                self.jumping = False
+                self.coyote_timer = self.game.coyote_time
+            elif self.vy < 0:
+                self.rect.top = hit.bottom
+
+            self.vy = 0
+
+    def check_world_edges(self):
+        if self.rect.left < 0:
+            self.rect.left = 0
+        elif self.rect.right > self.game.world_width:
+            self.rect.right = self.game.world_width
+        elif self.rect.top > HEIGHT:
+            self.hearts = 0
+            self.game.log('death', cause='fall', level=self.game.current_level)
+
+    def check_items(self):
+        item_hash = self.game.item_hash
+        hits = [item for item in item_hash.query(self.rect) if self.rect.colliderect(item.rect)]
+
+        for item in hits:
+            item.kill()
+            item_hash.remove(item)
+
+        for item in hits:
+            item.apply(self)
+
+    def check_enemies(self):
+        hits = [enemy for enemy in self.game.enemy_hash.query(self.rect) if self.rect.colliderect(enemy.rect)]
+
+        for enemy in hits:
+            if self.hurt_timer == 0:
+                self.hearts -= 1
+                self.hurt_timer = 1.0 * FPS
+                self.game.log('hit', enemy=type(enemy).__name__.lower(), hearts=self.hearts)
+                self.game.events.append('hurt')
+
+            if self.rect.centerx < enemy.rect.centerx:
+                self.vx = -5
+            elif self.rect.centerx > enemy.rect.centerx:
+                self.vx = 5
+            if self.rect.centery < enemy.rect.centery:
+                self.vy = -5
+            elif self.rect.centery > enemy.rect.centery:
+                self.vy = 5
+
+
+            if self.hearts == 0:
+                self.kill()
+                self.game.log('death', cause='enemy', level=self.game.current_level)
+
+
+        self.hurt_timer -= 1
+
+        if self.hurt_timer < 0:
+            self.hurt_timer = 0
+
+    def check_portals(self):
+        pass
+
+    def add_score(self, points):
+        self.score += points
+        self.game.log('score', points=points, score=self.score)
+
+    def reached_goal(self):
+        return pygame.sprite.spritecollideany(self, self.game.goal)
+
+    def animate(self):
+        if self.jumping:
+            motion = JUMP
+        elif self.vx == 0:
+            motion = IDLE
+        else:
+            motion = WALK
+
+        self.clip = HERO + 2 * motion + (not self.facing_right)
+
+    def update(self):
+        self.apply_gravity()
+        self.check_world_edges()
+        self.check_items()
+        self.check_enemies()
+        self.check_portals()
+        self.move_and_check_platforms()
+        self.reached_goal()
+        self.animate()
+
+class Currency(Entity):
+
+    def __init__(self, game, x, y, image):
+        super().__init__(game, x, y, image)
+
+class Gold(Currency):
+    def apply(self, character):
+        character.gold_coins += 1
+        self.game.log('pickup', item='gold', count=character.gold_coins)
+        character.add_score(10)
+        self.game.events.append('coin')
+
+class Bronze(Currency):
+    def apply(self, character):
+        character.bronze_coins += 1
+        self.game.log('pickup', item='bronze', count=character.bronze_coins)
+        character.add_score(20)
+        self.game.events.append('coin')
+
+class Enemy(AnimatedEntity):
+
+    def __init__(self, game, x, y, clip):
+        super().__init__(game, x, y, clip)
+
+        self.spawn = (x, y)
+        self.vx = -2
+        self.vy = 0
+
+    # the left-facing frames are shown while moving right
+    def face(self):
+        self.clip = self.clip & ~1 | (self.vx > 0)
+
+    def reverse(self):
+        self.vx *= -1
+        self.face()
+
+    def move_and_check_platforms(self):
+        self.rect.x += self.vx
+
+        hits = self.game.tile_grid.collide(self.rect)
+
+        for hit in hits:
+            if self.vx > 0:
+                self.rect.right = hit.left
+                self.reverse()
+            elif self.vx < 0:
+                self.rect.left = hit.right
+                self.reverse()
+
+        self.rect.y += self.vy
+
+        hits = self.game.tile_grid.collide(self.rect)
+
+        for hit in hits:
+            if self.vy > 0:
+                self.rect.bottom = hit.top
+            elif self.vy < 0:
+                self.rect.top = hit.bottom
+
+            self.vy = 0
+
+    def check_world_edges(self):
+        if self.rect.left < 0:
+            self.rect.left = 0
+            self.reverse()
+        elif self.rect.right > self.game.world_width:
+            self.rect.right = self.game.world_width
+            self.reverse()
+        elif self.rect.top > HEIGHT:
+            self.kill()
+            self.game.enemy_hash.remove(self)
+
+    def check_platform_edges(self):
+        self.rect.y += 2
+        hits = self.game.tile_grid.collide(self.rect)
+        self.rect.y  -= 2
+
+        must_reverse = True
+
+        for platform in hits:
+            if self.vx <= 0 and platform.left <= self.rect.left:
+                must_reverse = False
+            elif self.vx >= 0 and platform.right >= self.rect.right:
+                must_reverse = False
+
+        if must_reverse:
+            self.reverse()
+
+class Slime(Enemy):
+
+    def __init__(self, game, x, y):
+        super().__init__(game, x, y, SLIME)
+
+        self.speed = 2
+        self.vx = -1 * self.speed
+        self.vy = 0
+
+    def update(self):
+        self.apply_gravity()
+        self.move_and_check_platforms()
+        self.check_world_edges()
+        self.check_platform_edges()
+
+class FlyMan(Enemy):
+
+    def __init__(self, game, x, y):
+        super().__init__(game, x, y, WINGMAN)
+
+        self.speed = 5
+        self.vx = -1 * self.speed
+        self.vy = 0
+
+    def update(self):
+        self.move_and_check_platforms()
+        self.check_world_edges()
+
+
+# Simulation
+class Game:
+
+    def __init__(self, images=None, levels=levels, seed=0, batch_enemies=False, streaming=False,
+                 activity_margin=None, telemetry=None, jump_buffer=JUMP_BUFFER,
+                 coyote_time=COYOTE_TIME, profiler=None):
+        if images is None:
+            images = AssetRegistry()
+
+        self.images = images
+        self.animations = AnimationLibrary(images)
+        self.levels = levels
+        self.seed = seed
+        self.random = random.Random(seed)
+        self.batch_enemies = batch_enemies
+        self.streaming = streaming
+        self.chunk_cols = CHUNK_COLS
+        self.activity_margin = activity_margin
+        self.telemetry = telemetry
+        self.jump_buffer = jump_buffer
+        self.coyote_time = coyote_time
+        self.profiler = profiler
+
+        self.tick = 0
+        self.elapsed = 0
+        self.events = []
+        self.history = deque(maxlen=REWIND_SECONDS * FPS // REWIND_INTERVAL)
+
+        self.start_game()
+        self.start_level()
+
+        self.start_snapshot = self.snapshot()
+        self.checkpoint = self.start_snapshot
+
+    def start_game(self):
+        self.hero = Hero(self, 0, 0)
+        self.stage = START
+        self.current_level = 0
+        self.countdown = 0
+        self.earn_points = True
+
+    def start_level(self):
+        self.platforms = pygame.sprite.Group()
+        self.items = pygame.sprite.Group()
+        self.enemies = pygame.sprite.Group()
+        self.player = pygame.sprite.GroupSingle()
+        self.goal = pygame.sprite.Group()
+        self.dynamic = pygame.sprite.Group()
+        self.awake = pygame.sprite.Group()
+        self.sleeping = {}
+
+        level = load_level(self.levels[self.current_level])
+        self.level = level
+
+        self.world_width = level.width * GRID_SIZE
+        self.world_height = level.height * GRID_SIZE
+
+        self.hero.move_to(level.start[0], level.start[1])
+        self.player.add(self.hero)
+        self.dynamic.add(self.hero)
+
+        images = self.images
+
+        self.gravity = level.gravity
+        self.terminal_velocity = level.terminal_velocity
+
+        self.tile_grid = TileGrid(self.profiler)
+        self.item_hash = SpatialHash()
+        self.enemy_hash = SpatialHash()
+        self.enemy_batches = []
+
+        if self.streaming:
+            self.start_streaming()
+        else:
+            for i, loc in enumerate(level.entities['flag']):
+                if i == 0:
+                    self.goal.add( Flag(self, loc[0], loc[1], images['door_top']) )
+                else:
+                    self.goal.add( Flag(self, loc[0], loc[1], images['door']) )
+
+            for x, y, kind in level.tile_locs():
+                self.platforms.add( Platform(self, x, y, images[TILE_IMAGES[kind]]) )
+
+            for loc in level.entities['gold']:
+                self.items.add( Gold(self, loc[0], loc[1], images['gold']) )
+
+            for loc in level.entities['spikeman']:
+                self.add_enemy( Slime(self, loc[0], loc[1]) )
+
+            for loc in level.entities['flyman']:
+                self.add_enemy( FlyMan(self, loc[0], loc[1]) )
+
+            for x, y, w, h in level.solid_rects():
+                self.tile_grid.add(pygame.Rect(x * GRID_SIZE, y * GRID_SIZE, w * GRID_SIZE, h * GRID_SIZE))
+
+            for item in self.items:
+                self.item_hash.add(item)
+
+            self.roster = list(self.enemies)
+            self.item_roster = list(self.items)
+            self.batch_all_enemies()
+
+        self.schedule()
+
+        if self.current_level + 1 < len(self.levels):
+            images.preload_level(self.levels[self.current_level + 1])
+
+        self.events.append('level_start')
+
+    def batch_all_enemies(self):
+        self.enemy_batches = []
+
+        if self.batch_enemies:
+            from enemy_batch import EnemyBatch, EnemyPacker
+
+            slimes = [e for e in self.enemies if isinstance(e, Slime)]
+            flymen = [e for e in self.enemies if isinstance(e, FlyMan)]
+
+            self.enemy_batches.append(EnemyBatch(self, slimes, True))
+            self.enemy_batches.append(EnemyBatch(self, flymen, False))
+
+            if not self.streaming:
+                self.enemy_packer = EnemyPacker(self.roster, self.enemy_batches, ENEMY_INTS, ENEMY_FLOATS)
+
+    def start_streaming(self):
+        self.chunks = {}
+        self.visited = set()
+        self.dormant = {}
+        self.collected = set()
+        self.chunk_entities = {}
+
+        for kind, locs in self.level.entities.items():
+            for i, loc in enumerate(locs):
+                self.chunk_entities.setdefault(loc[0] // self.chunk_cols, []).append((kind, i, loc))
+
+        self.stream()
+
+    def chunk_range(self, margin):
+        chunk_width = self.chunk_cols * GRID_SIZE
+        offset = self.camera_offset()
+
+        first = max((offset - margin) // chunk_width, 0)
+        last = min((offset + WIDTH + margin - 1) // chunk_width, (self.level.cols - 1) // self.chunk_cols)
+
+        return first, last
+
+    def stream(self):
+        first, last = self.chunk_range(STREAM_MARGIN)
+        keep = range(first - 1, last + 2)
+
+        wanted = [i for i in range(first, last + 1) if i not in self.chunks]
+        released = [i for i in self.chunks if i not in keep]
+
+        if len(wanted) == 0 and len(released) == 0:
+            if not any(self.unloaded_chunk(enemy.rect) is not None for enemy in self.enemies):
+                return
+
+        for batch in self.enemy_batches:
+            batch.push()
+
+        for i in released:
+            self.release_chunk(i)
+
+        for i in wanted:
+            self.load_chunk(i)
+
+        self.sleep_enemies()
+        self.batch_all_enemies()
+
+    def load_chunk(self, index):
+        level = self.level
+        images = self.images
+
+        first_col = index * self.chunk_cols
+        last_col = first_col + self.chunk_cols
+
+        sprites = []
+        rects = []
+        items = []
+
+        for x, y, kind in level.tile_locs(first_col, last_col):
+            platform = Platform(self, x, y, images[TILE_IMAGES[kind]])
+            self.platforms.add(platform)
+            sprites.append(platform)
+
+        for x, y, w, h in level.solid_rects(first_col, last_col):
+            rect = pygame.Rect(x * GRID_SIZE, y * GRID_SIZE, w * GRID_SIZE, h * GRID_SIZE)
+            self.tile_grid.add(rect)
+            rects.append(rect)
+
+        for kind, i, loc in self.chunk_entities.get(index, []):
+            if kind == 'flag':
+                if i == 0:
+                    flag = Flag(self, loc[0], loc[1], images['door_top'])
+                else:
+                    flag = Flag(self, loc[0], loc[1], images['door'])
+
+                self.goal.add(flag)
+                sprites.append(flag)
+            elif kind == 'gold':
+                if (kind, i) not in self.collected:
+                    item = Gold(self, loc[0], loc[1], images['gold'])
+                    self.items.add(item)
+                    self.item_hash.add(item)
+                    items.append(((kind, i), item))
+            elif index not in self.visited:
+                if kind == 'spikeman':
+                    self.add_enemy( Slime(self, loc[0], loc[1]) )
+                elif kind == 'flyman':
+                    self.add_enemy( FlyMan(self, loc[0], loc[1]) )
+
+        for cls, topleft, vx, vy in self.dormant.pop(index, []):
+            enemy = cls(self, 0, 0)
+            enemy.rect.topleft = topleft
+            enemy.last_pos = topleft
+            enemy.vx = vx
+            enemy.vy = vy
+            enemy.face()
+            self.add_enemy(enemy)
+
+        self.visited.add(index)
+        self.chunks[index] = (sprites, rects, items)
+
+    def release_chunk(self, index):
+        sprites, rects, items = self.chunks.pop(index)
+
+        for sprite in sprites:
+            sprite.kill()
+
+        for rect in rects:
+            self.tile_grid.remove(rect)
+
+        for key, item in items:
+            if item.alive():
+                item.kill()
+                self.item_hash.remove(item)
+            else:
+                self.collected.add(key)
+
+    def add_enemy(self, enemy):
+        self.enemies.add(enemy)
+        self.enemy_hash.add(enemy)
+
+        if self.batch_enemies:
+            pass
+        elif self.activity_margin is None:
+            self.wake(enemy)
+        else:
+            self.sleeping.setdefault(enemy.rect.left // ACTIVITY_CELL, []).append(enemy)
+
+    def unloaded_chunk(self, rect):
+        chunk_width = self.chunk_cols * GRID_SIZE
+        left = rect.left // chunk_width
+        right = (rect.right - 1) // chunk_width
+
+        if left not in self.chunks:
+            return left
+        elif right not in self.chunks:
+            return right
+
+        return None
+
+    def sleep_enemies(self):
+        for enemy in list(self.enemies):
+            index = self.unloaded_chunk(enemy.rect)
+
+            if index is not None:
+                state = (type(enemy), enemy.rect.topleft, enemy.vx, enemy.vy)
+                self.dormant.setdefault(index, []).append(state)
+                self.forget(enemy)
+                enemy.kill()
+                self.enemy_hash.remove(enemy)
+
+    def activity_bounds(self):
+        if self.activity_margin is None:
+            return None
+
+        offset = self.camera_offset()
+
+        return offset - self.activity_margin, offset + WIDTH + self.activity_margin
+
+    def wake(self, enemy):
+        self.awake.add(enemy)
+        self.dynamic.add(enemy)
+
+    def sleep(self, enemy):
+        self.awake.remove(enemy)
+        self.dynamic.remove(enemy)
+        self.sleeping.setdefault(enemy.rect.left // ACTIVITY_CELL, []).append(enemy)
+
+    def forget(self, enemy):
+        bucket = self.sleeping.get(enemy.rect.left // ACTIVITY_CELL)
+
+        if bucket is not None and enemy in bucket:
+            bucket.remove(enemy)
+
+            if len(bucket) == 0:
+                del self.sleeping[enemy.rect.left // ACTIVITY_CELL]
+
+    def schedule(self):
+        bounds = self.activity_bounds()
+
+        if bounds is None or self.batch_enemies:
+            return
+
+        left, right = bounds
+
+        for enemy in list(self.awake):
+            if enemy.rect.right <= left or enemy.rect.left >= right:
+                self.sleep(enemy)
+
+        for cell in range((left - ACTIVITY_CELL) // ACTIVITY_CELL, (right - 1) // ACTIVITY_CELL + 1):
+            bucket = self.sleeping.get(cell)
+
+            if bucket is None:
+                continue
+
+            for enemy in list(bucket):
+                if enemy.rect.right > left and enemy.rect.left < right:
+                    bucket.remove(enemy)
+                    self.wake(enemy)
+
+            if len(bucket) == 0:
+                del self.sleeping[cell]
+
+    def snapshot(self):
+        hero = self.hero
+
+        hero_state = (hero.rect.x, hero.rect.y, hero.last_pos, hero.vx, hero.vy, hero.facing_right, hero.jumping,
+                      hero.jump_timer, hero.coyote_timer, hero.hearts, hero.gold_coins, hero.bronze_coins,
+                      hero.score, hero.hurt_timer, hero.clip, hero.phase, hero.alive())
+
+        if self.streaming:
+            for batch in self.enemy_batches:
+                batch.push()
+
+            enemies = items = None
+            stream = self.pack_stream()
+        else:
+            if self.batch_enemies:
+                enemies = self.enemy_packer.pack()
+            else:
+                ints = array('q')
+                floats = array('d')
+
+                for enemy in self.roster:
+                    ints.extend((enemy.rect.x, enemy.rect.y, enemy.last_pos[0], enemy.last_pos[1],
+                                 enemy.clip, enemy.phase, enemy.alive()))
+                    floats.extend((enemy.vx, enemy.vy))
+
+                enemies = (ints, floats)
+
+            items = bytes(item.alive() for item in self.item_roster)
+            stream = None
+
+        return Snapshot(self.elapsed, self.stage, self.current_level, self.level,
+                        self.countdown, self.earn_points,
+                        self.random.getstate(), self.gravity, self.terminal_velocity,
+                        hero_state, enemies, items, stream)
+
+    def pack_stream(self):
+        chunk_width = self.chunk_cols * GRID_SIZE
+        collected = set(self.collected)
+        dormant = {index: list(states) for index, states in self.dormant.items()}
+
+        for sprites, rects, items in self.chunks.values():
+            collected.update(key for key, item in items if not item.alive())
+
+        for enemy in self.enemies:
+            state = (type(enemy), enemy.rect.topleft, enemy.vx, enemy.vy)
+            dormant.setdefault(max(enemy.rect.left // chunk_width, 0), []).append(state)
+
+        return (frozenset(collected), frozenset(self.visited),
+                tuple((index, tuple(states)) for index, states in dormant.items()))
+
+    def restore(self, snapshot):
+        if snapshot.level != self.current_level or snapshot.data is not self.level:
+            self.current_level = snapshot.level
+            self.start_level()
+
+        stale = snapshot.data is not self.level
+
+        self.elapsed = snapshot.elapsed
+        self.stage = snapshot.stage
+        self.countdown = snapshot.countdown
+        self.earn_points = snapshot.earn_points
+        self.random.setstate(snapshot.random)
+
+        hero = self.hero
+        start = hero.rect.topleft
+
+        (hero.rect.x, hero.rect.y, hero.last_pos, hero.vx, hero.vy, hero.facing_right, hero.jumping,
+         hero.jump_timer, hero.coyote_timer, hero.hearts, hero.gold_coins, hero.bronze_coins,
+         hero.score, hero.hurt_timer, hero.clip, hero.phase, alive) = snapshot.hero
+
+        if stale:
+            hero.rect.topleft = start
+            hero.last_pos = start
+        else:
+            self.gravity = snapshot.gravity
+            self.terminal_velocity = snapshot.terminal_velocity
+
+            self.dynamic.empty()
+            self.awake.empty()
+            self.sleeping = {}
+
+        if alive:
+            self.player.add(hero)
+            self.dynamic.add(hero)
+        else:
+            hero.kill()
+
+        if stale:
+            pass
+        elif self.streaming:
+            self.restore_stream(snapshot.stream)
+        else:
+            ints, floats = snapshot.enemies
+            self.enemies.empty()
+            self.enemy_hash = SpatialHash()
+
+            for i, enemy in enumerate(self.roster):
+                j = i * ENEMY_INTS
+                enemy.rect.x, enemy.rect.y = ints[j], ints[j + 1]
+                enemy.last_pos = (ints[j + 2], ints[j + 3])
+                enemy.clip, enemy.phase = ints[j + 4], ints[j + 5]
+                enemy.vx, enemy.vy = floats[i * ENEMY_FLOATS], floats[i * ENEMY_FLOATS + 1]
+
+                if ints[j + 6]:
+                    self.add_enemy(enemy)
+
+            self.items.empty()
+            self.item_hash = SpatialHash()
+
+            for item, alive in zip(self.item_roster, snapshot.items):
+                if alive:
+                    self.items.add(item)
+                    self.item_hash.add(item)
+
+            self.batch_all_enemies()
+
+        self.schedule()
+        self.events.append('restore')
+
+    def restore_stream(self, stream):
+        collected, visited, dormant = stream
+
+        for index in list(self.chunks):
+            self.release_chunk(index)
+
+        for enemy in self.enemies:
+            enemy.kill()
+
+        self.enemy_hash = SpatialHash()
+        self.collected = set(collected)
+        self.visited = set(visited)
+        self.dormant = {index: list(states) for index, states in dormant}
+
+        self.stream()
+
+    def reload_level(self):
+        level = load_level(self.levels[self.current_level])
+        diff = diff_levels(self.level, level)
+
+        for batch in self.enemy_batches:
+            batch.push()
+
+        self.level = level
+        self.world_width = level.width * GRID_SIZE
+        self.world_height = level.height * GRID_SIZE
+        self.gravity = level.gravity
+        self.terminal_velocity = level.terminal_velocity
+
+        if self.streaming:
+            self.reload_stream()
+        else:
+            self.apply_tiles(diff.tiles)
+            self.apply_entities(diff.entities)
+            self.batch_all_enemies()
+
+        self.schedule()
+
+        self.history.clear()
+        self.events.append('level_reload')
+        self.log('level_reload', level=self.current_level, tiles=len(diff.tiles), entities=sorted(diff.entities),
+                 resized=diff.resized)
+
+        return diff
+
+    def apply_tiles(self, tiles):
+        images = self.images
+        platforms = {platform.rect.center: platform for platform in self.platforms}
+
+        for x, y, old, new in tiles:
+            cell = pygame.Rect(x * GRID_SIZE, y * GRID_SIZE, GRID_SIZE, GRID_SIZE)
+            platform = platforms.pop(cell.center, None)
+
+            if platform is not None:
+                platform.kill()
+
+            if new != EMPTY:
+                self.platforms.add( Platform(self, x, y, images[TILE_IMAGES[new]]) )
+
+            if old == EMPTY and new != EMPTY:
+                self.tile_grid.add(cell)
+            elif old != EMPTY and new == EMPTY:
+                self.tile_grid.cut(cell)
+
+    def apply_entities(self, entities):
+        images = self.images
+
+        if 'flag' in entities:
+            self.goal.empty()
+
+            for i, loc in enumerate(self.level.entities['flag']):
+                if i == 0:
+                    self.goal.add( Flag(self, loc[0], loc[1], images['door_top']) )
+                else:
+                    self.goal.add( Flag(self, loc[0], loc[1], images['door']) )
+
+        removed, added = entities.get('gold', ([], []))
+
+        for loc in removed:
+            center = (loc[0] * GRID_SIZE + GRID_SIZE // 2, loc[1] * GRID_SIZE + GRID_SIZE // 2)
+            item = next((item for item in self.item_roster if item.rect.center == center), None)
+
+            if item is None:
+                continue
+
+            self.item_roster.remove(item)
+            item.kill()
+            self.item_hash.remove(item)
+
+        for loc in added:
+            item = Gold(self, loc[0], loc[1], images['gold'])
+            self.items.add(item)
+            self.item_hash.add(item)
+            self.item_roster.append(item)
+
+        for kind, cls in [('spikeman', Slime), ('flyman', FlyMan)]:
+            removed, added = entities.get(kind, ([], []))
+
+            for loc in removed:
+                enemy = next((enemy for enemy in self.roster if type(enemy) is cls and enemy.spawn == loc), None)
+
+                if enemy is None:
+                    continue
+
+                self.roster.remove(enemy)
+                self.forget(enemy)
+                enemy.kill()
+                self.enemy_hash.remove(enemy)
+
+            for loc in added:
+                enemy = cls(self, loc[0], loc[1])
+                self.add_enemy(enemy)
+                self.roster.append(enemy)
+
+    def reload_stream(self):
+        for index in list(self.chunks):
+            self.release_chunk(index)
+
+        for enemy in self.enemies:
+            enemy.kill()
+
+        self.enemy_hash = SpatialHash()
+        self.sleeping = {}
+        self.start_streaming()
+
+    def rewind(self, seconds=REWIND_SECONDS):
+        target = self.elapsed - seconds * FPS
+
+        while len(self.history) > 1 and self.history[-1].elapsed > target:
+            self.history.pop()
+
+        if len(self.history) > 0:
+            self.restore(self.history.pop())
+
+    def retry(self):
+        self.history.clear()
+        self.restore(self.checkpoint)
+
+    def begin(self):
+        if self.stage == START:
+            self.stage = PLAYING
+
+    def restart(self):
+        self.history.clear()
+        self.checkpoint = self.start_snapshot
+        self.restore(self.start_snapshot)
+
+    def set_profiler(self, profiler):
+        self.profiler = profiler
+        self.tile_grid.profiler = profiler
+
+    def log(self, name, **fields):
+        if self.telemetry is not None:
+            self.telemetry.record(self.tick, name, fields)
+
+    def camera_offset(self):
+        if self.hero.rect.centerx < WIDTH // 2:
+            return 0
+        elif self.hero.rect.centerx > self.world_width - WIDTH // 2:
+            return self.world_width - WIDTH
+        else:
+            return self.hero.rect.centerx - WIDTH // 2
+
+    def step(self, inputs=NO_INPUT):
+        for sprite in self.dynamic:
+            sprite.last_pos = sprite.rect.topleft
+
+        if self.stage == PLAYING:
+            if self.elapsed % REWIND_INTERVAL == 0:
+                self.history.append(self.snapshot())
+
+            if inputs.jump:
+                self.hero.buffer_jump()
+
+            self.hero.check_jump()
+
+            if inputs.move < 0:
+                self.hero.move_left()
+            elif inputs.move > 0:
+                self.hero.move_right()
+            else:
+                self.hero.stop()
+
+            if self.profiler is None:
+                self.dynamic.update()
+            else:
+                start = time.perf_counter()
+                self.dynamic.update()
+                self.profiler.add('sprites', time.perf_counter() - start)
+
+            for batch in self.enemy_batches:
+                batch.update()
+
+            for enemy in self.awake:
+                self.enemy_hash.move(enemy)
+
+            if self.streaming:
+                self.stream()
+
+            self.schedule()
+
+            if self.hero.hearts == 0:
+                self.stage = LOSE
+            elif self.hero.reached_goal():
+                self.stage = LEVEL_COMPLETE
+                self.countdown = 3 * FPS
+                self.events.append('level_complete')
+                self.log('level_complete', level=self.current_level, score=self.hero.score)
+        elif self.stage == LEVEL_COMPLETE:
+            self.countdown -= 1
+            if self.countdown <= 0:
+                self.current_level += 1
+
+                if self.current_level < len(self.levels):
+                    self.start_level()
+                    self.stage = PLAYING
+                    self.history.clear()
+                    self.checkpoint = self.snapshot()
+                else:
+                    self.stage = WIN
+
+            if self.earn_points == True:
+                self.hero.add_score(100)
+                self.earn_points = False
+
+        self.tick += 1
+        self.elapsed += 1
+
+        return self.state()
+
+    def state(self):
+        hero = self.hero
+        events = self.events
+        self.events = []
+
+        return State(self.tick, self.stage, self.current_level, hero.rect.x, hero.rect.y, hero.vx, hero.vy,
+                     hero.hearts, hero.score, hero.gold_coins, hero.bronze_coins, events)
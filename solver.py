@@ -0,0 +1,194 @@
+# Imports
+import os
+import struct
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from simulation import Game, levels
+
+
+# Solver settings
+#
+# A hero state is (x, y, vy, coyote timer): the horizontal speed is set from
+# the input on every tick, so it never carries over. Each tick tries walking
+# left, right or standing still, and jumping as well whenever a jump would be
+# taken, on the ground or within coyote time. Jumps go through the same
+# check_jump() as in the game. A buffered press only ever fires on a later
+# tick where pressing would have done the same, so the jump buffer starts
+# empty on every tick. Enemies and coins do not change the hero's path here,
+# so only the tiles are taken into account.
+#
+# States are packed into STATE bytes, which take about 60% of the memory of
+# a tuple of the same values. The search goes one tick at a time; with more than one worker each
+# tick's frontier is split into CHUNK_STATES sized chunks that the workers
+# expand on their own copy of the level, so a single large level uses every
+# core. A search that stops at MAX_STATES without reaching the flag is
+# undecided, not failed.
+MAX_STATES = 10000000
+CHUNK_STATES = 20000
+MOVES = [-1, 0, 1]
+STATE = struct.Struct('<iidi')
+
+
+def advance(hero, state, move, jump):
+    hero.rect.x, hero.rect.y, hero.vy, hero.coyote_timer = state
+    hero.jump_timer = 0
+
+    if jump:
+        hero.buffer_jump()
+
+    hero.check_jump()
+
+    if move < 0:
+        hero.move_left()
+    elif move > 0:
+        hero.move_right()
+    else:
+        hero.stop()
+
+    hero.apply_gravity()
+    hero.check_world_edges()
+    hero.move_and_check_platforms()
+
+    return hero.rect.x, hero.rect.y, hero.vy, hero.coyote_timer
+
+def can_jump(hero, state):
+    hero.rect.x, hero.rect.y, hero.vy, hero.coyote_timer = state
+    return hero.coyote_timer > 0 or hero.on_ground()
+
+
+class Search:
+
+    def __init__(self, path):
+        self.game = Game(levels=[path])
+
+        self.hero = self.game.hero
+        self.flags = [flag.rect for flag in self.game.goal]
+        self.coins = [item.rect for item in self.game.items]
+
+    def first(self):
+        hero = self.hero
+        return STATE.pack(hero.rect.x, hero.rect.y, hero.vy, hero.coyote_timer)
+
+    def expand(self, states):
+        hero = self.hero
+        found = set()
+        reached_flag = False
+        reached_coins = set()
+
+        for packed in states:
+            state = STATE.unpack(packed)
+            hero.rect.x, hero.rect.y = state[0], state[1]
+
+            if not reached_flag and hero.rect.collidelist(self.flags) >= 0:
+                reached_flag = True
+
+            reached_coins.update(hero.rect.collidelistall(self.coins))
+
+            jumps = [False, True] if can_jump(hero, state) else [False]
+
+            for jump in jumps:
+                for move in MOVES:
+                    hero.hearts = 1
+                    after = advance(hero, state, move, jump)
+
+                    if hero.hearts > 0:
+                        found.add(STATE.pack(*after))
+
+            self.game.events.clear()
+
+        return found, reached_flag, reached_coins
+
+
+searches = {}
+
+def expand(path, states):
+    search = searches.get(path)
+
+    if search is None:
+        search = searches[path] = Search(path)
+
+    return search.expand(states)
+
+def check_level(path, max_states=MAX_STATES, pool=None):
+    start = time.perf_counter()
+    search = Search(path)
+
+    first = search.first()
+    seen = {first}
+    frontier = [first]
+    reached_flag = False
+    reached_coins = set()
+    stopped = False
+
+    while len(frontier) > 0 and not stopped:
+        if pool is None:
+            results = [search.expand(frontier)]
+        else:
+            chunks = [frontier[i:i + CHUNK_STATES] for i in range(0, len(frontier), CHUNK_STATES)]
+            results = pool.map(expand, [path] * len(chunks), chunks)
+
+        frontier = []
+
+        for found, flag, coins in results:
+            reached_flag = reached_flag or flag
+            reached_coins.update(coins)
+
+            for state in found:
+                if state in seen:
+                    continue
+                elif len(seen) >= max_states:
+                    stopped = True
+                    break
+
+                seen.add(state)
+                frontier.append(state)
+
+    level = search.game.level
+
+    return {'path': path,
+            'flag': reached_flag,
+            'coins': len(reached_coins),
+            'total_coins': len(search.coins),
+            'missing_coins': [level.entities['gold'][i] for i in range(len(search.coins))
+                              if i not in reached_coins],
+            'states': len(seen),
+            'complete': not stopped,
+            'seconds': time.perf_counter() - start}
+
+def check_levels(paths, workers=None, max_states=MAX_STATES):
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    if workers == 1:
+        return [check_level(path, max_states) for path in paths]
+
+    with ProcessPoolExecutor(workers) as pool:
+        return [check_level(path, max_states, pool) for path in paths]
+
+
+if __name__ == '__main__':
+    paths = sys.argv[1:] or levels
+    failed = False
+
+    for result in check_levels(paths):
+        if result['flag']:
+            status = 'ok'
+        elif result['complete']:
+            status = 'FLAG UNREACHABLE'
+            failed = True
+        else:
+            status = 'undecided'
+
+        if not result['complete']:
+            status += ' (search stopped at ' + str(result['states']) + ' states)'
+
+        print(result['path'] + ': ' + status + ', coins ' + str(result['coins']) + '/' +
+              str(result['total_coins']) + ', ' + str(result['states']) + ' states in ' +
+              '%.1f' % result['seconds'] + 's')
+
+        if result['complete']:
+            for loc in result['missing_coins']:
+                print('  unreachable coin at ' + str(list(loc)))
+
+    sys.exit(1 if failed else 0)
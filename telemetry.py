@@ -0,0 +1,73 @@
+# Imports
+import json
+import threading
+from collections import deque
+
+
+# Telemetry settings
+#
+# Gameplay code calls record() with the tick, an event name and a dict of
+# fields. That only appends a tuple to a ring buffer, so an event costs the
+# same however slow the file or terminal behind it is. A writer thread wakes
+# every FLUSH_INTERVAL seconds, or once the buffer is half full, and writes
+# the batch as JSON Lines, one object per event. If the writer falls behind,
+# the oldest events are dropped and counted; the frame never waits for it.
+CAPACITY = 4096
+FLUSH_INTERVAL = 1.0
+
+
+class Telemetry:
+
+    def __init__(self, path, capacity=CAPACITY, interval=FLUSH_INTERVAL):
+        self.path = path
+        self.capacity = capacity
+        self.interval = interval
+        self.buffer = deque(maxlen=capacity)
+        self.dropped = 0
+        self.closed = False
+        self.wake = threading.Event()
+        self.file = open(path, 'w')
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def record(self, tick, name, fields):
+        buffer = self.buffer
+
+        if len(buffer) == self.capacity:
+            self.dropped += 1
+
+        buffer.append((tick, name, fields))
+
+        if len(buffer) >= self.capacity // 2:
+            self.wake.set()
+
+    def run(self):
+        while not self.closed:
+            self.wake.wait(self.interval)
+            self.wake.clear()
+            self.write()
+
+    def write(self):
+        buffer = self.buffer
+        lines = []
+
+        while len(buffer) > 0:
+            tick, name, fields = buffer.popleft()
+            event = {'tick': tick, 'event': name}
+            event.update(fields)
+            lines.append(json.dumps(event, separators=(',', ':')))
+
+        if len(lines) > 0:
+            self.file.write('\n'.join(lines) + '\n')
+            self.file.flush()
+
+    def close(self):
+        self.closed = True
+        self.wake.set()
+        self.thread.join()
+        self.write()
+
+        if self.dropped > 0:
+            self.file.write(json.dumps({'event': 'dropped', 'count': self.dropped}, separators=(',', ':')) + '\n')
+
+        self.file.close()
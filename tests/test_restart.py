@@ -0,0 +1,46 @@
+import os
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+
+
+@pytest.fixture
+def game(monkeypatch):
+    monkeypatch.chdir(ROOT)
+    monkeypatch.syspath_prepend(ROOT)
+
+    from simulation import Game, PLAYING
+
+    game = Game()
+    game.stage = PLAYING
+
+    return game
+
+
+def test_retry_after_restart_returns_to_first_level(game):
+    from simulation import PLAYING, LOSE, FPS
+
+    flag = next(iter(game.goal))
+    game.hero.rect.center = flag.rect.center
+    game.hero.vy = 0
+
+    for i in range(4 * FPS):
+        game.step()
+
+    assert game.current_level == 1
+    assert game.hero.score > 0
+
+    game.restart()
+    game.stage = PLAYING
+    game.hero.hearts = 0
+    game.step()
+
+    assert game.stage == LOSE
+
+    game.retry()
+
+    assert game.current_level == 0
+    assert game.hero.score == 0
@@ -1,24 +1,68 @@
 # Imports
+import os
 import pygame
-import random
-import json
+import time
+from collections import OrderedDict
+from assets import AssetRegistry, SOUNDS
+from simulation import Game, Inputs
+from replay import Recorder, decode, load_log, new_game
+from profiler import FrameProfiler, PHASES
+from render import make_backend, AutoScale, AUTO_SCALES, StaticLayer, draw_background, draw_world, screen_rect
+from telemetry import Telemetry
+from simulation import GRID_SIZE, WIDTH, HEIGHT, FPS, ACTIVE_MARGIN
+from simulation import START, PLAYING, LOSE, LEVEL_COMPLETE, WIN
 
 
 # Window settings
-GRID_SIZE = 64
-WIDTH = 23 * GRID_SIZE
-#1380
-HEIGHT = 12 * GRID_SIZE
-#720
 TITLE = "Platformer"
-FPS = 60
+RENDER_BACKEND = 'surface'
+RENDER_SCALE = 1.0
+RENDER_FILTER = 'nearest'
+DIRTY_RECTS = False
+DIRTY_MAX_RECTS = 24
+DIRTY_MAX_AREA = 0.4
+BATCH_ENEMIES = False
+STREAMING = False
+ACTIVE_REGION = False
+STREAM_LAYER_CHUNKS = 8
+MAX_FRAME_SKIP = 5
+RECORD_PATH = None
+TELEMETRY_PATH = None
+REPLAY_PATH = None
+PROFILE_NESTED = True
+PROFILE_PREFIX = 'profile'
+HOT_RELOAD = False
+HOT_RELOAD_INTERVAL = 0.5
+STATUS_TIME = 2.0
+TICK_TIME = 1.0 / FPS
+INPUT_MARGIN = 0.002
+
+# RENDER_SCALE is the fraction of the window resolution the world is drawn at,
+# or 'auto' to lower it while frames take longer than TICK_TIME.
+# RENDER_FILTER is 'nearest' for whole-number upscales or 'smooth'.
+# PROFILE_NESTED also times sprite updates and tile collisions, only while
+# the profiler overlay is open as the timing slows the update down.
+# DIRTY_RECTS redraws only the regions of sprites that changed, with
+# overlapping regions merged. Past DIRTY_MAX_RECTS regions, or once they
+# cover DIRTY_MAX_AREA of the screen, the frame is redrawn whole instead.
+# ACTIVE_REGION only updates enemies within ACTIVE_MARGIN pixels of the
+# camera; enemies further away stand still until the hero gets near.
+# HOT_RELOAD checks the current level file every HOT_RELOAD_INTERVAL seconds
+# and applies any changes to the running level, showing the outcome at the
+# bottom of the screen for STATUS_TIME seconds.
+# TELEMETRY_PATH, when set, is where gameplay events are written as JSON Lines.
+# After a frame is shown the loop sleeps until INPUT_MARGIN seconds before the
+# next tick is due, then reads input and runs the tick, so a press waits as
+# little as possible before the game sees it. A press read in a frame that
+# runs no tick is kept for the next one. As the tick runs up to INPUT_MARGIN
+# early, frames show the state it produced, only interpolated back by the
+# part of a tick it ran ahead, and a press counts as shown once a frame
+# interpolates towards the tick that used it.
 
 
 # Create window
 pygame.init()
-screen = pygame.display.set_mode([WIDTH, HEIGHT])
-pygame.display.set_caption(TITLE)
-clock = pygame.time.Clock()
+screen = make_backend(RENDER_BACKEND, [WIDTH, HEIGHT], TITLE)
 
 
 # Define colors
@@ -27,12 +71,13 @@ BLACK = (0, 0, 0)
 GRAY = (88, 93, 99)
 LIGHT_GRAY = (175, 175, 175)
 
-# Stages
-START = 0
-PLAYING = 1
-LOSE = 2
-LEVEL_COMPLETE = 3
-WIN = 4
+PHASE_COLORS = {'input': (120, 200, 255),
+                'update': (90, 220, 110),
+                'draw': (250, 200, 60),
+                'hud': (250, 130, 40),
+                'overlay': (150, 150, 150),
+                'display': (220, 80, 200),
+                'wait': (120, 120, 190)}
 
 # Load fonts
 font_xl = pygame.font.Font('assets/fonts/Sketchy.otf', 115)
@@ -40,452 +85,178 @@ font_lg = pygame.font.Font('assets/fonts/Sketchy.otf', 64)
 font_md = pygame.font.Font('assets/fonts/Sketchy.otf', 32)
 font_xs = pygame.font.Font(None, 14)
 
-# Load images
-hero_idle_imgs_rt = [pygame.image.load('assets/images/characters/alien/alienBeige_stand.png').convert_alpha()]
-hero_walk_imgs_rt = [pygame.image.load('assets/images/characters/alien/alienBeige_walk1.png').convert_alpha(),
-                    pygame.image.load('assets/images/characters/alien/alienBeige_walk2.png').convert_alpha()]
-hero_jump_imgs_rt = [pygame.image.load('assets/images/characters/alien/alienBeige_jump.png').convert_alpha()]
-hero_idle_imgs_lt = [pygame.transform.flip(img, True, False) for img in hero_idle_imgs_rt]
-hero_walk_imgs_lt = [pygame.transform.flip(img, True, False) for img in hero_walk_imgs_rt]
-hero_jump_imgs_lt = [pygame.transform.flip(img, True, False) for img in hero_jump_imgs_rt]
-slime_imgs_rt = [pygame.image.load('assets/images/characters/enemies/moreenemies/slime.png').convert_alpha(),
-                 pygame.image.load('assets/images/characters/enemies/moreenemies/slime_walk.png').convert_alpha()]
-slime_imgs_lt = [pygame.transform.flip(img, True, False) for img in slime_imgs_rt]
-
-wingman_imgs_rt = [pygame.image.load('assets/images/characters/enemies/wingMan1.png').convert_alpha(),
-                pygame.image.load('assets/images/characters/enemies/wingMan2.png').convert_alpha(),
-                pygame.image.load('assets/images/characters/enemies/wingMan3.png').convert_alpha(),
-                pygame.image.load('assets/images/characters/enemies/wingMan4.png').convert_alpha(),
-                pygame.image.load('assets/images/characters/enemies/wingMan5.png').convert_alpha()]
-wingman_imgs_lt = [pygame.transform.flip(img, True, False) for img in wingman_imgs_rt]
-
-dirt_img = pygame.image.load('assets/images/PNG/tiles/dirt.png').convert_alpha()
-block_img = pygame.image.load('assets/images/PNG/tiles/stone_block.png').convert_alpha()
-doortop_img = pygame.image.load('assets/images/PNG/tiles/door_top.png').convert_alpha()
-door_img = pygame.image.load('assets/images/PNG/tiles/door.png').convert_alpha()
-grass_dirt = pygame.image.load('assets/images/PNG/tiles/grass_dirt.png').convert_alpha()
-gold_img = pygame.image.load('assets/images/PNG/items/gold_1.png').convert_alpha()
-bronze_img = pygame.image.load('assets/images/PNG/items/bronze_1.png').convert_alpha()
-heart_img = pygame.image.load('assets/images/PNG/items/heart.png').convert_alpha()
-gem_img = pygame.image.load('assets/images/HUD/coin_gold.png').convert_alpha()
-bg_img = pygame.image.load('assets/images/background/backgroundColorForest.png').convert_alpha()
-
-# Load sounds
-jump_snd = pygame.mixer.Sound('assets/sounds/jump.wav')
-gem_snd = pygame.mixer.Sound('assets/sounds/obtained_coin.ogg')
-level_up_snd = pygame.mixer.Sound('assets/sounds/level_complete.ogg')
-hurt_snd = pygame.mixer.Sound('assets/sounds/hurt.ogg')
-lose_snd = pygame.mixer.Sound('assets/sounds/lose.ogg')
-win_snd = pygame.mixer.Sound('assets/sounds/win.ogg')
+# Images and sounds load on first use
+assets = AssetRegistry(atlas=True)
 
 # Load Music
 intro = 'assets/music/intro.ogg'
 
 
-# Levels
-levels = ['assets/levels/world-1.json',
-          'assets/levels/world-2.json',
-          'assets/levels/world-3.json']
+# Text cache
+class TextCache:
 
-# Game classes
-class Entity(pygame.sprite.Sprite):
-    
-    def __init__(self, x, y, image):
-        super().__init__()
-        
-        self.image = image
-        self.rect = self.image.get_rect()
-        self.rect.centerx = x * GRID_SIZE + GRID_SIZE // 2
-        self.rect.centery = y * GRID_SIZE + GRID_SIZE // 2
-
-        self.vx = 0
-        self.vy = 0
-
-    def apply_gravity(self):
-        self.vy += gravity
-
-        if self.vy > terminal_velocity:
-            self.vy = terminal_velocity
-
-
-class AnimatedEntity(Entity):
-
-    def __init__(self, x, y, images):
-        super().__init__(x, y, images[0])
-
-        self.images = images
-        self.image_index = 0
-        self.ticks = 0
-        self.animation_speed = 10
-
-    def set_image_list(self):
-        self.images = self.images
-        
-    def animate(self):
-        self.set_image_list()
-        self.ticks += 1
-
-        if self.ticks % self.animation_speed == 0:
-            self.image_index += 1
-
-            if self.image_index >= len(self.images):
-                self.image_index = 0
-                
-            self.image = self.images[self.image_index]
-        
-
-class Platform(Entity):
-    
-    def __init__(self, x, y, image):
-        super().__init__(x, y, image)
-
-
-class Flag(Entity):
-    
-    def __init__(self, x, y, image):
-        super().__init__(x, y, image)
-
-
-class Hero(AnimatedEntity):
-    
-    def __init__(self, x, y, images):
-        super().__init__(x, y, images)
-
-        self.speed = 5
-        self.jump_power = 13
-        self.vx = 0
-        self.vy = 0
-        self.facing_right = True
-        self.jumping = False
-
-        self.hearts = 3
-        self.gold_coins = 0
-        self.bronze_coins = 0
-        self.score = 0
-
-        self.hurt_timer = 0
-
-    def move_to(self, x, y):
-        self.rect.centerx = x * GRID_SIZE + GRID_SIZE // 2
-        self.rect.centery = y * GRID_SIZE + GRID_SIZE // 2
-       
-    def move_right(self):
-    	self.vx = self.speed
-    	self.facing_right = True
-    	
-    def move_left(self):
-    	self.vx = -self.speed
-    	self.facing_right = False
-
-    def stop(self):
-        self.vx = 0
-    
-    def jump(self):
-        self.rect.y += 2
-        hits = pygame.sprite.spritecollide(self, platforms, False)
-        self.rect.y -= 2
-
-        if len(hits) > 0:
-            self.vy = -1 * self.jump_power
-            self.jumping = True
-            jump_snd.play()
-
-    def move_and_check_platforms(self):
-        self.rect.x += self.vx
-
-        hits = pygame.sprite.spritecollide(self, platforms, False)
-
-        for hit in hits:
-            if self.vx > 0:
-                self.rect.right = hit.rect.left
-            elif self.vx < 0:
-                self.rect.left = hit.rect.right
-
-        self.rect.y += self.vy
-
-        hits = pygame.sprite.spritecollide(self, platforms, False)
-
-        for hit in hits:
-            if self.vy > 0:
-                self.rect.bottom = hit.rect.top
-                self.jumping = False
-            elif self.vy < 0:
-                self.rect.top = hit.rect.bottom
-
-            self.vy = 0
-
-    def check_world_edges(self):
-        if self.rect.left < 0:
-            self.rect.left = 0
-        elif self.rect.right > world_width:
-            self.rect.right = world_width
-        elif self.rect.top > HEIGHT:
-            self.hearts = 0
-            print( "RIP: hardcore parkour" )
-
-    def check_items(self):
-        hits = pygame.sprite.spritecollide(self, items, True)
-
-        for item in hits:
-            item.apply(self)
-            
-    def check_enemies(self):
-        hits = pygame.sprite.spritecollide(self, enemies, False)
-
-        for enemy in hits:
-            if self.hurt_timer == 0:
-                self.hearts -= 1
-                self.hurt_timer = 1.0 * FPS
-                print( 'hearts = ' + str(self.hearts) )
-                hurt_snd.play()
+    def __init__(self, max_size=512):
+        self.max_size = max_size
+        self.surfaces = OrderedDict()
 
-            if self.rect.centerx < enemy.rect.centerx:
-                self.vx = -5
-            elif self.rect.centerx > enemy.rect.centerx:
-                self.vx = 5
-            if self.rect.centery < enemy.rect.centery:
-                self.vy = -5
-            elif self.rect.centery > enemy.rect.centery:
-                self.vy = 5
+    def render(self, font, text, color):
+        key = (font, text, color)
+        surface = self.surfaces.get(key)
 
+        if surface is None:
+            surface = font.render(text, True, color)
+            self.surfaces[key] = surface
 
-            if self.hearts == 0:
-                self.kill()
-                print("RIP: death by enemy")    
-
-
-        self.hurt_timer -= 1
+            if len(self.surfaces) > self.max_size:
+                self.surfaces.popitem(last=False)
+        else:
+            self.surfaces.move_to_end(key)
 
-        if self.hurt_timer < 0:
-            self.hurt_timer = 0
+        return surface
 
-    def check_portals(self):
-        pass
+    def blit_glyphs(self, surface, font, text, color, pos, anchor='topleft'):
+        glyphs = [self.render(font, char, color) for char in text]
 
-    def reached_goal(self):
-        return pygame.sprite.spritecollideany(self, goal)
+        rect = pygame.Rect(0, 0, sum(g.get_width() for g in glyphs), font.get_height())
+        setattr(rect, anchor, pos)
 
-    def set_image_list(self):
-        if self.facing_right:
-            if self.jumping:
-                self.images = hero_jump_imgs_rt
-            elif self.vx == 0:
-                self.images = hero_idle_imgs_rt
-            else:
-                self.images = hero_walk_imgs_rt
-        else:
-            if self.jumping:
-                self.images = hero_jump_imgs_lt
-            elif self.vx == 0:
-                self.images = hero_idle_imgs_lt
-            else:
-                self.images = hero_walk_imgs_lt
-        
-    def update(self):
-        self.apply_gravity()
-        self.check_world_edges()
-        self.check_items()
-        self.check_enemies()
-        self.check_portals()
-        self.move_and_check_platforms()
-        self.reached_goal()
-        self.animate()
-        
-class Currency(Entity):
-    
-    def __init__(self, x, y, image):
-        super().__init__(x, y, image)
-        
-class Gold(Currency):
-    def apply(self, character):
-        character.gold_coins += 1
-        print( 'gold coins = ' + str(character.gold_coins) )
-        character.score += 10
-        gem_snd.play()
-
-class Bronze(Currency):
-    def apply(self, character):
-        character.bronze_coins += 1
-        print( 'bronze coins = ' + str(character.bronze_coins) )
-        character.score += 20
-        gem_snd.play()
-
-class Enemy(AnimatedEntity):
-
-    def __init__(self, x, y, images):
-        super().__init__(x, y, images)
-
-        self.vx = -2
-        self.vy = 0
-
-    def reverse(self):
-        self.vx *= -1
-        
-    def move_and_check_platforms(self):
-        self.rect.x += self.vx
-
-        hits = pygame.sprite.spritecollide(self, platforms, False)
-
-        for hit in hits:
-            if self.vx > 0:
-                self.rect.right = hit.rect.left
-                self.reverse()
-            elif self.vx < 0:
-                self.rect.left = hit.rect.right
-                self.reverse()
-
-        self.rect.y += self.vy
-
-        hits = pygame.sprite.spritecollide(self, platforms, False)
-
-        for hit in hits:
-            if self.vy > 0:
-                self.rect.bottom = hit.rect.top
-            elif self.vy < 0:
-                self.rect.top = hit.rect.bottom
-
-            self.vy = 0
-
-    def check_world_edges(self):
-        if self.rect.left < 0:
-            self.rect.left = 0
-            self.reverse()
-        elif self.rect.right > world_width:
-            self.rect.right = world_width
-            self.reverse()
-        elif self.rect.top > HEIGHT:
-            self.kill()
-        
-    def check_platform_edges(self):
-        self.rect.y += 2
-        hits = pygame.sprite.spritecollide(self, platforms, False)
-        self.rect.y  -= 2
-
-        must_reverse = True
-
-        for platform in hits:
-            if self.vx <= 0 and platform.rect.left <= self.rect.left:
-                must_reverse = False
-            elif self.vx >= 0 and platform.rect.right >= self.rect.right:
-                must_reverse = False
-
-        if must_reverse:
-            self.reverse()
-
-class Slime(Enemy):
-
-    def __init__(self, x, y, images):
-        super().__init__(x, y, images)
-        
-        self.speed = 2
-        self.vx = -1 * self.speed
-        self.vy = 0
-
-    def set_image_list(self):
-        if self.vx > 0:
-            self.images = slime_imgs_lt
-        else:
-            self.images = slime_imgs_rt
-    
-    def update(self):
-        self.apply_gravity()
-        self.move_and_check_platforms()
-        self.check_world_edges()
-        self.check_platform_edges()
-        self.animate()
-
-class FlyMan(Enemy):
-
-    def __init__(self, x, y, images):
-        super().__init__(x, y, images)
-        self.animation_speed = 8
-
-        self.speed = 5
-        self.vx = -1 * self.speed
-        self.vy = 0
-
-    def set_image_list(self):
-        if self.vx > 0:
-            self.images = wingman_imgs_lt
-        else:
-            self.images = wingman_imgs_rt
+        x = rect.x
+        for glyph in glyphs:
+            surface.blit(glyph, [x, rect.y])
+            x += glyph.get_width()
 
-    def update(self):
-        self.move_and_check_platforms()
-        self.check_world_edges()
-        self.animate()
+        return rect
 
+text_cache = TextCache()
 
 # Helper Functions
 def show_start_screen():
-    text = font_xl.render(TITLE, True, WHITE)
+    text = text_cache.render(font_xl, TITLE, WHITE)
     rect = text.get_rect()
     rect.midbottom = WIDTH // 2, HEIGHT // 2
     screen.blit(text, rect)
     
-    text = font_lg.render('Press any key to start', True, WHITE)
+    text = text_cache.render(font_lg, 'Press any key to start', WHITE)
     rect = text.get_rect()
     rect.midtop = WIDTH // 2, HEIGHT // 2
     screen.blit(text, rect)
 
 
 def show_lose_screen():
-    text = font_xl.render('GAME OVER', True, WHITE)
+    text = text_cache.render(font_xl, 'GAME OVER', WHITE)
 
     # hi Hannah it me Kuya
-    kuya = font_xl.render('HEEEEEY', True, BLACK)
+    kuya = text_cache.render(font_xl, 'HEEEEEY', BLACK)
     
     rect = text.get_rect()
     rect.midbottom = WIDTH // 2, HEIGHT // 2
     screen.blit(text, rect)
     
-    text = font_lg.render("Press 'R' to play again", True, WHITE)
+    text = text_cache.render(font_lg, "Press 'R' to play again", WHITE)
     rect = text.get_rect()
     rect.midtop = WIDTH // 2, HEIGHT // 2
     screen.blit(text, rect)
 
+    top = rect.bottom + 16
+    text = text_cache.render(font_md, "'C' retries the level, Backspace rewinds", WHITE)
+    rect = text.get_rect()
+    rect.midtop = WIDTH // 2, top
+    screen.blit(text, rect)
+
 def show_win_screen():
-    text = font_xl.render('You Win!', True, WHITE)
+    text = text_cache.render(font_xl, 'You Win!', WHITE)
     rect = text.get_rect()
     rect.midbottom = WIDTH // 2, HEIGHT // 2
     screen.blit(text, rect)
     
-    text = font_lg.render("Press 'R' to play again", True, WHITE)
+    text = text_cache.render(font_lg, "Press 'R' to play again", WHITE)
     rect = text.get_rect()
     rect.midtop = WIDTH // 2, HEIGHT // 2
     screen.blit(text, rect)
 
 def show_level_complete_screen():
-    text = font_xl.render('Level complete!', True, WHITE)
+    text = text_cache.render(font_xl, 'Level complete!', WHITE)
     rect = text.get_rect()
     rect.midbottom = WIDTH // 2, HEIGHT // 2
     screen.blit(text, rect)
 
 def show_hud():
-    text = font_md.render( str(hero.score), True, WHITE )
-    rect = text.get_rect()
-    rect.midtop = WIDTH // 2, 16
-    screen.blit(text, rect)
+    hero = game.hero
 
-    screen.blit(gem_img, [WIDTH - 100, 27]) 
-    text = font_md.render('x' + str(hero.gold_coins), True, WHITE )
-    rect = text.get_rect()
-    rect.topleft =  WIDTH - 60, 24
-    screen.blit(text, rect)
+    text_cache.blit_glyphs(screen, font_md, str(hero.score), WHITE, [WIDTH // 2, 16], 'midtop')
+
+    screen.blit(assets['gem'], [WIDTH - 100, 27]) 
+    text_cache.blit_glyphs(screen, font_md, 'x' + str(hero.gold_coins), WHITE, [WIDTH - 60, 24])
 
     for i in range(hero.hearts):
         x = i * 36
         y = 16
-        screen.blit(heart_img, [x, y])
+        screen.blit(assets['heart'], [x, y])
+
+def visible_sprites(offset_x):
+    view = pygame.Rect(offset_x, 0, WIDTH, HEIGHT).inflate(2 * GRID_SIZE, 2 * GRID_SIZE)
+    visible = {}
+
+    for group in [game.player, game.items, game.enemies]:
+        for sprite in group:
+            if sprite.rect.colliderect(view):
+                rect = screen_rect(sprite, offset_x, alpha)
+                rect.size = sprite.image.get_size()
+                visible[sprite] = (rect, sprite.image)
+
+    return visible
+
+def merge_rects(rects, limit):
+    merged = []
+
+    for rect in rects:
+        rect = rect.clip(SCREEN_RECT)
+
+        if rect.width == 0 or rect.height == 0:
+            continue
+
+        i = rect.collidelist(merged)
+
+        while i != -1:
+            rect = rect.union(merged.pop(i))
+            i = rect.collidelist(merged)
+
+        merged.append(rect)
+
+        if len(merged) > limit:
+            return None
+
+    return merged
+
+def changed_rects(before, after):
+    dirty = []
+
+    for sprite in before.keys() | after.keys():
+        old = before.get(sprite)
+        new = after.get(sprite)
+
+        if old == new:
+            continue
+        elif old is None:
+            dirty.append(new[0])
+        elif new is None:
+            dirty.append(old[0])
+        elif old[0].colliderect(new[0]):
+            dirty.append(old[0].union(new[0]))
+        else:
+            dirty.append(old[0])
+            dirty.append(new[0])
+
+    return dirty
 
 def show_grid(offset_x=0, offset_y=0):
     for x in range(0, WIDTH + GRID_SIZE, GRID_SIZE):
         adj_x = x - offset_x % GRID_SIZE
-        pygame.draw.line(screen, LIGHT_GRAY, [adj_x, 0], [adj_x, HEIGHT], 1)
+        screen.line(LIGHT_GRAY, [adj_x, 0], [adj_x, HEIGHT], 1)
 
     for y in range(0, HEIGHT + GRID_SIZE, GRID_SIZE):
         adj_y = y - offset_y % GRID_SIZE
-        pygame.draw.line(screen, LIGHT_GRAY, [0, adj_y], [WIDTH, adj_y], 1)
+        screen.line(LIGHT_GRAY, [0, adj_y], [WIDTH, adj_y], 1)
 
     for x in range(0, WIDTH + GRID_SIZE, GRID_SIZE):
         for y in range(0, HEIGHT + GRID_SIZE, GRID_SIZE):
@@ -495,229 +266,507 @@ def show_grid(offset_x=0, offset_y=0):
             disp_y = y // GRID_SIZE + offset_y // GRID_SIZE
             
             point = '(' + str(disp_x) + ',' + str(disp_y) + ')'
-            text = font_xs.render(point, True, LIGHT_GRAY)
-            screen.blit(text, [adj_x, adj_y])
+            text_cache.blit_glyphs(screen, font_xs, point, LIGHT_GRAY, [adj_x, adj_y])
 
+def show_profiler():
+    frame_time, averages = profiler.averages()
+    panel = pygame.Rect(WIDTH - 330, GRID_SIZE + 24, 310, 280)
+    text = 'frame %.2f ms' % (1000 * frame_time)
 
-# Setup
-def start_game():
-    global hero, stage, current_level
+    if world is not screen:
+        text += ', world at %d%%' % round(100 * world.scale)
 
-    hero = Hero(0, 0, hero_idle_imgs_rt)
-    stage = START
-    current_level = 0
-    
-    
+    screen.blit(profiler_panel, panel)
 
-def start_level():
-    global platforms, items, enemies, player, goal, all_sprites
-    global gravity, terminal_velocity
-    global world_width, world_height
+    graph = pygame.Rect(panel.x + 10, panel.y + 10, panel.width - 20, 120)
+    scale = graph.height / 40.0
 
-    
-    platforms = pygame.sprite.Group()
-    items = pygame.sprite.Group()
-    enemies = pygame.sprite.Group()
-    player = pygame.sprite.GroupSingle()
-    goal = pygame.sprite.Group()
-    all_sprites = pygame.sprite.Group()
+    for ms in [1000.0 / FPS, 2000.0 / FPS]:
+        y = graph.bottom - round(ms * scale)
+        screen.line(LIGHT_GRAY, [graph.left, y], [graph.right, y], 1)
 
-    with open(levels[current_level]) as f:
-        data = json.load(f)
+    records = list(profiler.frames)[-graph.width // 2:]
+    x = graph.right - 2 * len(records)
 
-    world_width = data['width'] * GRID_SIZE
-    world_height = data['height'] * GRID_SIZE
+    for record in records:
+        bottom = graph.bottom
 
-    hero.move_to(data['start'][0], data['start'][1])
-    player.add(hero)
+        for name, value in profiler.totals(record).items():
+            height = min(round(1000 * value * scale), bottom - graph.top)
 
-    for i, loc in enumerate(data['flag_locs']):
-        if i == 0:
-            goal.add( Flag(loc[0], loc[1], doortop_img) )
-        else:
-            goal.add( Flag(loc[0], loc[1], door_img) )
+            if height > 0:
+                screen.fill(PHASE_COLORS.get(name, WHITE), [x, bottom - height, 2, height])
+                bottom -= height
 
-    for loc in data['grass_locs']:
-        platforms.add( Platform(loc[0], loc[1], grass_dirt) )
+        x += 2
 
-    for loc in data['block_locs']:
-        platforms.add( Platform(loc[0], loc[1], block_img) )
+    y = graph.bottom + 8
+    text_cache.blit_glyphs(screen, font_xs, text, WHITE, [panel.x + 10, y])
 
-    for loc in data['dirt_locs']:
-        platforms.add( Platform(loc[0], loc[1], dirt_img) )
+    latency = profiler.sample_averages().get('input_latency')
 
-    for loc in data['gold_locs']:
-        items.add( Gold(loc[0], loc[1], gold_img) )
+    if latency is not None:
+        y += 12
+        text_cache.blit_glyphs(screen, font_xs, 'input to display %.1f ms' % (1000 * latency), WHITE,
+                               [panel.x + 10, y])
 
-    for loc in data['spikeman_locs']:
-        enemies.add( Slime(loc[0], loc[1], slime_imgs_lt) )
+    for name in PHASES + [name for name in sorted(averages) if name not in PHASES]:
+        y += 12
+        color = PHASE_COLORS.get(name, LIGHT_GRAY)
+        text = name + ' %.2f ms' % (1000 * averages.get(name, 0.0))
+        text_cache.blit_glyphs(screen, font_xs, text, color, [panel.x + 10, y])
 
-    for loc in data['flyman_locs']:
-        enemies.add( FlyMan(loc[0], loc[1], wingman_imgs_rt) )
+def draw_frame(offset_x):
+    if world is not screen:
+        world.begin()
 
+    draw_world(world, game, static_layer, assets['background'], offset_x, alpha, GRID_SIZE)
 
-    gravity = data['gravity']
-    terminal_velocity = data['terminal_velocity']
+    if world is not screen:
+        world.upscale()
 
-    all_sprites.add(player, platforms, items, enemies, goal)
+    profiler.phase('hud')
+    show_hud()
+    show_status()
+    profiler.phase('draw')
+
+    if grid_on:
+        show_grid(offset_x)
+
+    show_stage()
+
+def show_stage():
+    stage = game.stage
 
     if stage == START:
+        screen.fill(GRAY)
+        show_start_screen()
+    elif stage == LOSE:
+        screen.fill(BLACK)
+        show_lose_screen()
+    elif stage == LEVEL_COMPLETE:
+        show_level_complete_screen()
+    elif stage == WIN:
+        show_win_screen()
+
+def draw_region(rect, offset_x, sprites):
+    below = []
+    above = []
+
+    for sprite, (sprite_rect, image) in sprites.items():
+        if sprite_rect.colliderect(rect):
+            if game.player.has(sprite):
+                below.append((image, sprite_rect))
+            else:
+                above.append((image, sprite_rect))
+
+    screen.set_clip(rect)
+    draw_background(screen, assets['background'], offset_x)
+    screen.blits(below)
+    static_layer.draw(screen, offset_x)
+    screen.blits(above)
+
+    if rect.colliderect(HUD_RECT):
+        show_hud()
+    if rect.colliderect(STATUS_RECT):
+        show_status()
+
+    show_stage()
+
+
+def set_render_scale(scale):
+    global world
+
+    if scale == 1:
+        world = screen
+    else:
+        world = screen.scaled(scale, RENDER_FILTER)
+
+def build_static_layer():
+    global static_layer
+
+    # the old layer's chunks go with it, so drop every texture made for them
+    screen.release_all()
+
+    if game.streaming:
+        static_layer = StaticLayer(screen, [game.platforms, game.goal], game.world_width, HEIGHT,
+                                   game.chunk_cols * GRID_SIZE, STREAM_LAYER_CHUNKS)
+    else:
+        static_layer = StaticLayer(screen, [game.platforms, game.goal], game.world_width, HEIGHT, WIDTH)
+
+def level_mtime():
+    try:
+        return os.stat(game.levels[game.current_level]).st_mtime_ns
+    except OSError:
+        return None
+
+def reload_level():
+    start = time.perf_counter()
+
+    try:
+        diff = game.reload_level()
+    except (OSError, ValueError, KeyError) as e:
+        game.log('level_reload_failed', level=game.current_level, error=str(e))
+        set_status('Reload failed: ' + str(e))
+        return
+
+    if diff.resized or game.streaming:
+        build_static_layer()
+    else:
+        xs = {x * GRID_SIZE for x, y, old, new in diff.tiles}
+
+        for locs in diff.entities.get('flag', []):
+            xs.update(loc[0] * GRID_SIZE for loc in locs)
+
+        static_layer.refresh(xs)
+
+    set_status('Reloaded in %.1f ms: %d tiles' % (1000 * (time.perf_counter() - start), len(diff.tiles)) +
+               ''.join(', ' + name for name in sorted(diff.entities)))
+
+def set_status(text):
+    global status_text, status_until
+
+    status_text = text
+    status_until = time.perf_counter() + STATUS_TIME
+
+def show_status():
+    if status_text is not None:
+        text = text_cache.render(font_md, status_text, WHITE)
+        screen.blit(text, [16, HEIGHT - text.get_height() - 8])
+
+def play_theme():
+    if game.stage == START:
         theme = 'assets/music/intro.ogg' # starting theme
-    elif stage == PLAYING:
+    else:
         theme = 'assets/music/theme.ogg' # running theme
-    elif stage == LEVEL_COMPLETE:
-        theme = 'assets/music/theme.ogg' # ending theme I guess 
 
     pygame.mixer.music.load(theme)
     pygame.mixer.music.play(-1)
-    
+
+def handle_events(events):
+    global level_file_mtime, last_offset_x
+
+    for name in events:
+        if name == 'level_start':
+            build_static_layer()
+            level_file_mtime = level_mtime()
+            last_offset_x = game.camera_offset()
+            play_theme()
+        elif name == 'restore':
+            last_offset_x = game.camera_offset()
+
+            if not pygame.mixer.music.get_busy():
+                play_theme()
+        elif name == 'level_complete':
+            pygame.mixer.music.stop()
+
+        if name in SOUNDS:
+            assets.sound(name).play()
+
+
 # Game loop
 play_lose_sound = True
 play_win_sound = True
 running = True
 grid_on = False
-earn_points = True
-
-start_game()
-start_level()
+profile_on = False
+
+profiler = FrameProfiler()
+profiler_panel = pygame.Surface([310, 280], pygame.SRCALPHA)
+profiler_panel.fill((0, 0, 0, 170))
+
+SCREEN_RECT = pygame.Rect(0, 0, WIDTH, HEIGHT)
+HUD_RECT = pygame.Rect(0, 0, WIDTH, GRID_SIZE + 16)
+STATUS_RECT = pygame.Rect(0, HEIGHT - GRID_SIZE, WIDTH, GRID_SIZE)
+
+if RENDER_SCALE == 'auto':
+    auto_scale = AutoScale(AUTO_SCALES[RENDER_FILTER], TICK_TIME)
+    set_render_scale(auto_scale.scale)
+else:
+    auto_scale = None
+    set_render_scale(RENDER_SCALE)
+
+last_view = None
+last_sprites = {}
+last_hud = None
+
+if REPLAY_PATH is not None:
+    replay_log = load_log(REPLAY_PATH)
+    replay_codes = replay_log.codes()
+    game = new_game(replay_log, assets)
+else:
+    replay_codes = None
+    game = Game(assets, batch_enemies=BATCH_ENEMIES, streaming=STREAMING,
+                activity_margin=ACTIVE_MARGIN if ACTIVE_REGION else None)
+
+if RECORD_PATH is not None:
+    recorder = Recorder(game)
+else:
+    recorder = None
+
+if TELEMETRY_PATH is not None:
+    game.telemetry = Telemetry(TELEMETRY_PATH)
+
+handle_events(game.state().events)
+
+next_reload_check = 0.0
+status_text = None
+status_until = 0.0
+accumulator = 0.0
+last_time = time.perf_counter()
+last_offset_x = game.camera_offset()
+alpha = 1.0
+jump = False
+jump_read = None
+input_reads = []
 
 
 while running:
     # Input handling
+    profiler.frame()
+    profiler.phase('input')
+    frame_start = time.perf_counter()
+
     for event in pygame.event.get():
         if event.type == pygame.QUIT:
             running = False
         elif event.type == pygame.KEYDOWN:
             if event.key == pygame.K_g:
                 grid_on = not grid_on
+
+            elif event.key == pygame.K_p:
+                profile_on = not profile_on
+
+                if profile_on and PROFILE_NESTED:
+                    game.set_profiler(profiler)
+                else:
+                    game.set_profiler(None)
+
+            elif event.key == pygame.K_o:
+                profiler.save_csv(PROFILE_PREFIX + '.csv')
+                profiler.save_trace(PROFILE_PREFIX + '.json')
+
+            elif replay_codes is not None:
+                pass
                 
-            elif stage == START:
-                stage = PLAYING
-                theme = 'assets/music/theme.ogg' # running theme
+            elif game.stage == START:
+                game.begin()
+                play_theme()
 
-                pygame.mixer.music.load(theme)
-                pygame.mixer.music.play(-1)
+                if recorder is not None:
+                    recorder.begin()
                 
-            elif stage == PLAYING:
+            elif event.key == pygame.K_BACKSPACE and game.stage in [PLAYING, LOSE]:
+                game.rewind()
+                play_lose_sound = True
+
+                if recorder is not None:
+                    recorder.rewind()
+
+            elif game.stage == PLAYING:
                 if event.key == pygame.K_SPACE:
-                    hero.jump()
+                    jump = True
                 elif event.key == pygame.K_UP:
-                    hero.jump()
+                    jump = True
                 elif event.key == pygame.K_w:
-                    hero.jump()
+                    jump = True
 
-            elif stage == LOSE:
+            elif game.stage == LOSE:
                 if event.key == pygame.K_r:
-                    start_game()
-                    start_level()
+                    game.restart()
                     play_lose_sound = False
-                    earn_points = True
 
-            elif stage == WIN:
+                    if recorder is not None:
+                        recorder.restart()
+
+                elif event.key == pygame.K_c:
+                    game.retry()
+                    play_lose_sound = True
+
+                    if recorder is not None:
+                        recorder.retry()
+
+            elif game.stage == WIN:
                 if event.key == pygame.K_r:
-                    start_game()
-                    start_level()
+                    game.restart()
                     play_win_sound = False
-                    earn_points = True
+
+                    if recorder is not None:
+                        recorder.restart()
                     
 
     pressed = pygame.key.get_pressed()
 
-    if stage == PLAYING:
-        if pressed[pygame.K_LEFT]:
-            hero.move_left()
-        elif pressed[pygame.K_a]:
-            hero.move_left()
-            
-        elif pressed[pygame.K_RIGHT]:
-            hero.move_right()
-        elif pressed[pygame.K_d]:
-            hero.move_right()
-            
-        else:
-            hero.stop()
+    if pressed[pygame.K_LEFT] or pressed[pygame.K_a]:
+        move = -1
+    elif pressed[pygame.K_RIGHT] or pressed[pygame.K_d]:
+        move = 1
+    else:
+        move = 0
+
+    if jump and jump_read is None:
+        jump_read = time.perf_counter()
    
     # Game logic
-    if stage == PLAYING:
-        all_sprites.update()
-
-        if hero.hearts == 0:
-            stage = LOSE
-        elif hero.reached_goal():
-            stage = LEVEL_COMPLETE
-            countdown = 3 * FPS
-            pygame.mixer.music.stop()
-            level_up_snd.play()
-    elif stage == LEVEL_COMPLETE:
-        countdown -= 1
-        if countdown <= 0:
-            current_level += 1
+    profiler.phase('update')
+    now = time.perf_counter()
 
-            if current_level < len(levels):
-                start_level()
-                stage = PLAYING
-            else:
-                stage = WIN
+    if HOT_RELOAD and now >= next_reload_check:
+        next_reload_check = now + HOT_RELOAD_INTERVAL
+        mtime = level_mtime()
 
-        if earn_points == True:
-            hero.score += 100
-            earn_points = False
-    
+        if mtime != level_file_mtime:
+            level_file_mtime = mtime
+            reload_level()
 
-    if hero.rect.centerx < WIDTH // 2:
-        offset_x = 0
-    elif hero.rect.centerx > world_width - WIDTH // 2:
-        offset_x = world_width - WIDTH
-    else:
-        offset_x = hero.rect.centerx - WIDTH // 2
-    
-    bg_offset_x = -1 * (0.05 * offset_x % bg_img.get_width())
+    accumulator += now - last_time
+    last_time = now
+    ticks = 0
+
+    while accumulator >= TICK_TIME - INPUT_MARGIN and ticks < MAX_FRAME_SKIP:
+        if replay_codes is not None:
+            code = next(replay_codes, None)
+
+            if code is None:
+                running = False
+                break
+
+            inputs, begin, restart, retry, rewind = decode(code)
+
+            if restart:
+                if game.stage == LOSE:
+                    play_lose_sound = False
+                else:
+                    play_win_sound = False
+
+                game.restart()
+
+            if retry:
+                game.retry()
+                play_lose_sound = True
+
+            if rewind:
+                game.rewind()
+                play_lose_sound = True
+
+            if begin:
+                game.begin()
+                play_theme()
+        else:
+            inputs = Inputs(move, jump)
+
+        if recorder is not None:
+            recorder.record(inputs)
+
+        last_offset_x = game.camera_offset()
+        state = game.step(inputs)
+        accumulator -= TICK_TIME
+        ticks += 1
+
+        if jump:
+            input_reads.append(jump_read)
+
+        jump = False
+        jump_read = None
+
+        handle_events(state.events)
+
+    if ticks == MAX_FRAME_SKIP:
+        accumulator = min(accumulator, TICK_TIME)
+
+    alpha = min(max(1 + accumulator / TICK_TIME, 0.0), 1.0)
+    offset_x = round(last_offset_x + (game.camera_offset() - last_offset_x) * alpha)
 
 
     # Drawing code
-    screen.blit(bg_img, [bg_offset_x, 0])
-    screen.blit(bg_img, [bg_offset_x + bg_img.get_width(), 0])
-        
-    for sprite in all_sprites:
-        screen.blit(sprite.image, [sprite.rect.x - offset_x, sprite.rect.y])
-        
-    show_hud()
+    profiler.phase('draw')
+    if status_text is not None and time.perf_counter() > status_until:
+        status_text = None
 
-    if grid_on:
-        show_grid(offset_x)
+    view = (game.stage, offset_x, grid_on, profile_on, status_text)
+    hud = (game.hero.score, game.hero.gold_coins, game.hero.hearts)
+    dirty = None
 
-    if stage == START:
-        screen.fill(GRAY)
-        show_start_screen()
-    elif stage == LOSE:
-        
-        screen.fill(BLACK)
-        show_lose_screen()
+    if DIRTY_RECTS and world.partial_updates:
+        sprites = visible_sprites(offset_x)
+
+        if not grid_on and not profile_on and view == last_view:
+            dirty = changed_rects(last_sprites, sprites)
+
+            if hud != last_hud:
+                dirty.append(HUD_RECT)
+
+            dirty = merge_rects(dirty, DIRTY_MAX_RECTS)
+
+            if dirty is not None and sum(rect.width * rect.height for rect in dirty) > DIRTY_MAX_AREA * WIDTH * HEIGHT:
+                dirty = None
+    else:
+        sprites = {}
+
+    if dirty is None:
+        draw_frame(offset_x)
+    else:
+        for rect in dirty:
+            draw_region(rect, offset_x, sprites)
+
+        screen.set_clip(None)
+
+    last_view = view
+    last_sprites = sprites
+    last_hud = hud
+
+
+    # Sounds
+    if game.stage == LOSE:
         pygame.mixer.music.stop()
 
         if play_lose_sound == True:
-            lose_snd.play()
+            assets.sound('lose').play()
             play_lose_sound = False
 
-            
-    elif stage == LEVEL_COMPLETE:
-        show_level_complete_screen()
-    elif stage == WIN:
-        show_win_screen()
-
+    elif game.stage == WIN:
         if play_win_sound == True:
-            win_snd.play()
+            assets.sound('win').play()
             play_win_sound = False
 
 
     # Update screen
-    pygame.display.update()
+    if profile_on:
+        profiler.phase('overlay')
+        show_profiler()
 
+    profiler.phase('display')
 
-    # Limit refresh rate of game loop 
-    clock.tick(FPS)
+    screen.present(dirty)
+
+    if len(input_reads) > 0 and alpha > 0:
+        shown = time.perf_counter()
+
+        for read in input_reads:
+            profiler.sample('input_latency', shown - read)
+
+        input_reads = []
+
+    if auto_scale is not None:
+        scale = auto_scale.update(time.perf_counter() - frame_start)
+
+        if world is screen and scale != 1 or world is not screen and scale != world.scale:
+            set_render_scale(scale)
+
+
+    # Wait until input is due for the next tick
+    profiler.phase('wait')
+    wait = TICK_TIME - INPUT_MARGIN - accumulator - (time.perf_counter() - last_time)
+
+    if wait > 0:
+        time.sleep(wait)
 
 
 # Close window and quit
-pygame.quit()
+if recorder is not None:
+    recorder.save(RECORD_PATH)
 
+if game.telemetry is not None:
+    game.telemetry.close()
+
+pygame.quit()